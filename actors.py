@@ -0,0 +1,139 @@
+import asyncio
+import contextvars
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Tuple
+
+from config import ACTOR_IDLE_TIMEOUT
+from tracing import detached_task
+
+logger = logging.getLogger("actors")
+
+# Commands where several pending requests collapse into one
+COLLAPSIBLE = {"skip", "pause", "resume", "set_volume", "apply_effects"}
+
+class Command:
+    """A pending player command, the futures waiting on its result and the context it runs in."""
+    __slots__ = ("name", "args", "futures", "context")
+
+    def __init__(self, name: str, args: Tuple, future: asyncio.Future):
+        self.name = name
+        self.args = args
+        self.futures: List[asyncio.Future] = [future]
+        # The submitter's context, so the command's spans land in its trace
+        self.context = contextvars.copy_context()
+
+    def merge(self, name: str, args: Tuple) -> bool:
+        """Fold a new command into this one if it is redundant with it."""
+        if name != self.name or name not in COLLAPSIBLE | {"stop"}:
+            return False
+        if name == "skip":
+            # Five skip presses become a single skip of five tracks
+            self.args = (self.args[0] + args[0],)
+        elif name == "set_volume":
+            # Only the latest volume matters
+            self.args = args
+        return True
+
+class ChatActor:
+    """Runs the player commands for one chat, one at a time and in order."""
+
+    def __init__(
+        self,
+        chat_id: int,
+        execute: Callable[..., Awaitable[Any]],
+        on_exit: Callable[[int, "ChatActor"], None],
+        idle_timeout: float = ACTOR_IDLE_TIMEOUT
+    ):
+        self.chat_id = chat_id
+        self.execute = execute
+        self.on_exit = on_exit
+        self.idle_timeout = idle_timeout
+        self.mailbox: Deque[Command] = deque()
+        self.closed = False
+        self._wakeup = asyncio.Event()
+        # The actor outlives whichever request started it, so it belongs to no trace
+        self._task = detached_task(self._run(), name=f"chat-actor-{chat_id}")
+
+    def submit(self, name: str, args: Tuple) -> asyncio.Future:
+        """Queue a command and return a future for its result."""
+        future = asyncio.get_running_loop().create_future()
+        tail = self.mailbox[-1] if self.mailbox else None
+
+        if tail is not None and tail.merge(name, args):
+            tail.futures.append(future)
+        else:
+            command = Command(name, args, future)
+            if name == "stop":
+                # A stop makes pending skips, pauses and volume changes pointless
+                while self.mailbox and self.mailbox[-1].name in COLLAPSIBLE:
+                    command.futures.extend(self.mailbox.pop().futures)
+            self.mailbox.append(command)
+
+        self._wakeup.set()
+        return future
+
+    async def _run(self):
+        try:
+            while True:
+                if not self.mailbox:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=self.idle_timeout)
+                    except asyncio.TimeoutError:
+                        if not self.mailbox:
+                            return
+                    continue
+
+                command = self.mailbox.popleft()
+                try:
+                    result = await command.context.run(
+                        asyncio.create_task, self.execute(self.chat_id, command.name, *command.args)
+                    )
+                except Exception as e:
+                    logger.error(f"Error running {command.name} in {self.chat_id}: {e}")
+                    result = False
+
+                for future in command.futures:
+                    if not future.done():
+                        future.set_result(result)
+        finally:
+            self.closed = True
+            for command in self.mailbox:
+                for future in command.futures:
+                    future.cancel()
+            self.mailbox.clear()
+            self.on_exit(self.chat_id, self)
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+class ChatActors:
+    """Starts a ChatActor per chat on demand and retires idle ones."""
+
+    def __init__(self, execute: Callable[..., Awaitable[Any]], idle_timeout: float = ACTOR_IDLE_TIMEOUT):
+        self.execute = execute
+        self.idle_timeout = idle_timeout
+        self.actors: Dict[int, ChatActor] = {}
+
+    async def submit(self, chat_id: int, name: str, *args) -> Any:
+        """Run a command in the chat's actor and wait for its result."""
+        actor = self.actors.get(chat_id)
+        if actor is None or actor.closed:
+            actor = ChatActor(chat_id, self.execute, self._on_exit, self.idle_timeout)
+            self.actors[chat_id] = actor
+
+        # Shield so a cancelled caller doesn't cancel a result shared with others
+        return await asyncio.shield(actor.submit(name, args))
+
+    def _on_exit(self, chat_id: int, actor: ChatActor):
+        if self.actors.get(chat_id) is actor:
+            del self.actors[chat_id]
+
+    async def stop(self):
+        """Stop every actor."""
+        await asyncio.gather(*(actor.stop() for actor in list(self.actors.values())))
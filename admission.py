@@ -0,0 +1,169 @@
+import asyncio
+import functools
+import logging
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, Tuple
+
+from config import (
+    MESSAGES,
+    USER_RATE_LIMIT,
+    USER_BURST,
+    CHAT_RATE_LIMIT,
+    CHAT_BURST,
+    MAX_CONCURRENT_RESOLVES,
+    MAX_PENDING_RESOLVES,
+)
+from metrics import ADMISSION_REJECTIONS, PENDING_RESOLVES
+
+logger = logging.getLogger("admission")
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at ``rate`` tokens per second."""
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        # ``now`` may have been read just before the bucket was created
+        if now <= self.updated:
+            return
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self, now: Optional[float] = None) -> bool:
+        """Check if a token is available without taking it."""
+        self._refill(now if now is not None else time.monotonic())
+        return self.tokens >= 1
+
+    def try_acquire(self, now: Optional[float] = None) -> bool:
+        """Take a token if one is available."""
+        if self.available(now):
+            self.tokens -= 1
+            return True
+        return False
+
+    def retry_after(self) -> float:
+        """Seconds until the next token is available."""
+        return max(0.0, (1 - self.tokens) / self.rate) if self.rate > 0 else math.inf
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+class AdmissionController:
+    """Per-user and per-chat rate limits plus a global cap on outstanding resolves."""
+
+    # Drop idle buckets once this many are tracked
+    PRUNE_THRESHOLD = 10000
+    # A rejected user hears about it at most once per cooldown, and at least this far apart
+    MIN_REPLY_INTERVAL = 10
+
+    def __init__(
+        self,
+        user_rate: float = USER_RATE_LIMIT,
+        user_burst: int = USER_BURST,
+        chat_rate: float = CHAT_RATE_LIMIT,
+        chat_burst: int = CHAT_BURST,
+        max_concurrent: int = MAX_CONCURRENT_RESOLVES,
+        max_pending: int = MAX_PENDING_RESOLVES
+    ):
+        # Rates are configured per minute
+        self.user_rate = user_rate / 60
+        self.user_burst = user_burst
+        self.chat_rate = chat_rate / 60
+        self.chat_burst = chat_burst
+        self.max_pending = max_pending
+        self.user_buckets: Dict[int, TokenBucket] = {}
+        self.chat_buckets: Dict[int, TokenBucket] = {}
+        self._semaphore = asyncio.Semaphore(max_concurrent) if max_concurrent > 0 else None
+        self.pending = 0
+        # (chat id, user id) -> time until which further rejections go unanswered
+        self.quiet_until: Dict[Tuple[int, int], float] = {}
+
+    def _bucket(self, buckets: Dict[int, TokenBucket], key: int, rate: float, burst: int) -> TokenBucket:
+        bucket = buckets.get(key)
+        if bucket is None:
+            if len(buckets) >= self.PRUNE_THRESHOLD:
+                self._prune(buckets)
+            bucket = buckets[key] = TokenBucket(rate, burst)
+        return bucket
+
+    @staticmethod
+    def _prune(buckets: Dict[int, TokenBucket]):
+        now = time.monotonic()
+        for key in [key for key, bucket in buckets.items() if bucket.is_full(now)]:
+            del buckets[key]
+
+    def check(self, chat_id: int, user_id: int) -> Optional[Tuple[str, float]]:
+        """Return ``(reason, retry_after)`` if the request should be rejected, else None."""
+        if self.max_pending and self.pending >= self.max_pending:
+            return "busy", 0.0
+
+        now = time.monotonic()
+        buckets = []
+        if self.user_rate > 0:
+            buckets.append(self._bucket(self.user_buckets, user_id, self.user_rate, self.user_burst))
+        if self.chat_rate > 0:
+            buckets.append(self._bucket(self.chat_buckets, chat_id, self.chat_rate, self.chat_burst))
+
+        # Only spend tokens once every bucket allows the request
+        for bucket in buckets:
+            if not bucket.available(now):
+                return "rate_limited", bucket.retry_after()
+        for bucket in buckets:
+            bucket.try_acquire(now)
+
+        return None
+
+    def should_reply(self, chat_id: int, user_id: int, retry_after: float) -> bool:
+        """Check if a rejection should be answered, muting the rest until the cooldown ends."""
+        now = time.monotonic()
+        key = (chat_id, user_id)
+        if self.quiet_until.get(key, 0) > now:
+            return False
+
+        if len(self.quiet_until) >= self.PRUNE_THRESHOLD:
+            for other in [other for other, until in self.quiet_until.items() if until <= now]:
+                del self.quiet_until[other]
+        self.quiet_until[key] = now + max(retry_after, self.MIN_REPLY_INTERVAL)
+        return True
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold one of the global resolve slots for the enclosed block."""
+        self.pending += 1
+        PENDING_RESOLVES.set(self.pending)
+        try:
+            if self._semaphore is None:
+                yield
+            else:
+                async with self._semaphore:
+                    yield
+        finally:
+            self.pending -= 1
+            PENDING_RESOLVES.set(self.pending)
+
+    def guarded(self, func):
+        """Decorator that rejects over-limit handler calls before any work is done."""
+        @functools.wraps(func)
+        async def wrapper(client, message):
+            user_id = message.from_user.id if message.from_user else 0
+            rejection = self.check(message.chat.id, user_id)
+            if rejection:
+                reason, retry_after = rejection
+                ADMISSION_REJECTIONS.inc(reason=reason)
+                if self.should_reply(message.chat.id, user_id, retry_after):
+                    await message.reply_text(MESSAGES[reason].format(seconds=math.ceil(retry_after)))
+                return
+            async with self.slot():
+                return await func(client, message)
+        return wrapper
+
+# Create global admission controller instance
+admission = AdmissionController()
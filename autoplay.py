@@ -0,0 +1,166 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+import sources
+from sources import registry
+from history import play_history, track_key
+from config import AUTOPLAY, AUTOPLAY_MAX_TRACKS
+
+logger = logging.getLogger("autoplay")
+
+# ``requested_by`` of songs the bot queued itself
+AUTOPLAY_USER_ID = 0
+
+# Songs remembered per chat so autoplay doesn't repeat them
+RECENT_TRACKS = 50
+
+# Candidates resolved per prefetch before giving up until the next song
+MAX_ATTEMPTS = 3
+
+# Seconds the player waits for a prefetch still in progress before leaving
+PREFETCH_WAIT = 10
+
+class Autoplay:
+    """Keeps a voice chat playing related tracks once its queue runs dry.
+
+    When the last queued song starts, a related track is picked (from the
+    song's source, else the chat's and everyone's play history) and resolved
+    in the background, so the stream end can switch to it straight away
+    instead of leaving the call. At most ``budget`` tracks are autoplayed in
+    a row; any song a user requests resets the count.
+    """
+
+    def __init__(self, enabled: bool = AUTOPLAY, budget: int = AUTOPLAY_MAX_TRACKS):
+        self.default = enabled
+        self.budget = budget
+        self.enabled: Dict[int, bool] = {}
+        self.remaining: Dict[int, int] = {}
+        self.seeds: Dict[int, Dict[str, Any]] = {}
+        self.recent: Dict[int, Deque[str]] = {}
+        self.prefetched: Dict[int, Dict[str, Any]] = {}
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+    def is_enabled(self, chat_id: int) -> bool:
+        return self.enabled.get(chat_id, self.default) and self.budget > 0
+
+    def set_enabled(self, chat_id: int, enabled: bool):
+        """Turn autoplay on or off for a chat."""
+        self.enabled[chat_id] = enabled
+        if not enabled:
+            self.clear(chat_id)
+
+    def played(self, chat_id: int, song_info: Dict[str, Any], has_next: bool):
+        """Note a song that started playing, and prefetch what follows if it is the last one."""
+        track = track_key(song_info)
+        if track:
+            self.recent.setdefault(chat_id, deque(maxlen=RECENT_TRACKS)).append(track)
+
+        if song_info.get("requested_by") != AUTOPLAY_USER_ID:
+            # A user picked something new: follow on from that instead
+            self.remaining[chat_id] = self.budget
+            self._drop_prefetch(chat_id)
+        self.seeds[chat_id] = song_info
+
+        if not has_next and not song_info.get("is_live"):
+            self.prefetch(chat_id)
+
+    def prefetch(self, chat_id: int):
+        """Resolve the next autoplay track in the background, if one is due."""
+        if (not self.is_enabled(chat_id) or self.remaining.get(chat_id, self.budget) <= 0
+                or chat_id in self.prefetched or chat_id in self._tasks or chat_id not in self.seeds):
+            return
+
+        task = asyncio.create_task(self._prefetch(chat_id, self.seeds[chat_id]), name=f"autoplay-{chat_id}")
+        self._tasks[chat_id] = task
+        task.add_done_callback(lambda done: self._task_done(chat_id, done))
+
+    def _task_done(self, chat_id: int, task: asyncio.Task):
+        if self._tasks.get(chat_id) is task:
+            del self._tasks[chat_id]
+
+    def pending(self, chat_id: int) -> Optional[asyncio.Task]:
+        """Return the prefetch still resolving the next track for a chat, starting it if one is due."""
+        if not self.is_enabled(chat_id) or self.remaining.get(chat_id, self.budget) <= 0:
+            return None
+
+        self.prefetch(chat_id)
+        return self._tasks.get(chat_id)
+
+    def next_song(self, chat_id: int) -> Optional[Dict[str, Any]]:
+        """Take the prefetched track for a chat whose queue ran dry, if it is ready."""
+        if not self.is_enabled(chat_id) or self.remaining.get(chat_id, self.budget) <= 0:
+            return None
+
+        song = self.prefetched.pop(chat_id, None)
+        if song is not None:
+            self.remaining[chat_id] = self.remaining.get(chat_id, self.budget) - 1
+        return song
+
+    def _drop_prefetch(self, chat_id: int):
+        task = self._tasks.pop(chat_id, None)
+        if task is not None:
+            task.cancel()
+        self.prefetched.pop(chat_id, None)
+
+    def clear(self, chat_id: int):
+        """Forget a chat's pending autoplay when playback stops."""
+        self._drop_prefetch(chat_id)
+        self.seeds.pop(chat_id, None)
+        self.remaining.pop(chat_id, None)
+
+    async def _candidates(self, chat_id: int, seed: Dict[str, Any]) -> List[Dict[str, Any]]:
+        candidates = []
+        url = seed.get("webpage_url")
+        if url and registry.for_url(url):
+            candidates.extend(await registry.related(url))
+
+        for track, _ in play_history.top(20, chat_id) + play_history.top(20):
+            if registry.for_url(track):
+                candidates.append(registry.get_cached_metadata(track) or {"webpage_url": track})
+
+        recent = set(self.recent.get(chat_id, ()))
+        unique = []
+        for candidate in candidates:
+            track = track_key(candidate)
+            if track and track not in recent and not sources.check_entry(candidate):
+                recent.add(track)
+                unique.append(candidate)
+        return unique
+
+    async def _prefetch(self, chat_id: int, seed: Dict[str, Any]):
+        try:
+            candidates = await self._candidates(chat_id, seed)
+            for candidate in candidates[:MAX_ATTEMPTS]:
+                url = candidate["webpage_url"]
+                info, audio_url = await registry.resolve(url, live=sources.is_live(candidate))
+                if info is None or sources.check_entry(info):
+                    continue
+
+                song_info = {**candidate, **info}
+                live = sources.is_live(song_info)
+                self.prefetched[chat_id] = {
+                    "title": song_info.get("title", "Unknown Title"),
+                    "duration": song_info.get("duration") or 0,
+                    "duration_str": "🔴 Live" if live else sources.format_duration(song_info.get("duration") or 0),
+                    "thumbnail": song_info.get("thumbnail", ""),
+                    "webpage_url": song_info.get("webpage_url") or url,
+                    "audio_url": audio_url,
+                    "is_live": live,
+                    "protocol": song_info.get("protocol"),
+                    "id": song_info.get("id"),
+                    "source": song_info.get("source"),
+                    "autoplay": True,
+                }
+                logger.info(f"Autoplay prefetched {self.prefetched[chat_id]['title']!r} for chat {chat_id}")
+                return
+
+            logger.info(f"No autoplay track found for chat {chat_id}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error prefetching autoplay track for chat {chat_id}: {e}")
+
+# Create global autoplay instance
+autoplay = Autoplay()
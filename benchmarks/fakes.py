@@ -0,0 +1,185 @@
+"""Local stand-ins for Telegram, py-tgcalls and yt-dlp used by the benchmarks."""
+import asyncio
+import hashlib
+import itertools
+import random
+import time
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+_message_ids = itertools.count(1)
+
+class FakeMessage:
+    """Minimal Pyrogram ``Message`` that records replies and edits on its client."""
+
+    def __init__(
+        self,
+        client: "FakeClient",
+        chat_id: int,
+        text: str = "",
+        user_id: int = 0,
+        first_name: str = "Bench",
+        reply_to_message: Optional["FakeMessage"] = None
+    ):
+        self._client = client
+        self.id = next(_message_ids)
+        self.chat = SimpleNamespace(id=chat_id)
+        self.from_user = SimpleNamespace(id=user_id, first_name=first_name)
+        self.text = text
+        self.caption = None
+        self.command: Optional[List[str]] = None
+        self.reply_to_message = reply_to_message
+
+    async def reply_text(self, text: str, **kwargs) -> "FakeMessage":
+        await self._client.record("send_message", self.chat.id, text)
+        return FakeMessage(self._client, self.chat.id, text)
+
+    async def edit_text(self, text: str, **kwargs) -> "FakeMessage":
+        await self._client.record("edit_message_text", self.chat.id, text)
+        self.text = text
+        return self
+
+class FakeClient:
+    """Pyrogram ``Client`` replacement that dispatches updates to registered handlers."""
+
+    def __init__(self, username: str = "bench_bot", user_id: int = 1, api_latency: float = 0.0):
+        self.me = SimpleNamespace(id=user_id, username=username, first_name=username)
+        self.api_latency = api_latency
+        self.sent: List[Tuple[float, str, int, str]] = []
+        self._message_handlers: List[Tuple[Any, Callable]] = []
+        self._callback_handlers: List[Tuple[Any, Callable]] = []
+
+    def on_message(self, flt=None):
+        def decorator(func):
+            self._message_handlers.append((flt, func))
+            return func
+        return decorator
+
+    def on_callback_query(self, flt=None):
+        def decorator(func):
+            self._callback_handlers.append((flt, func))
+            return func
+        return decorator
+
+    async def record(self, method: str, chat_id: int, text: str):
+        if self.api_latency:
+            await asyncio.sleep(self.api_latency)
+        self.sent.append((time.perf_counter(), method, chat_id, text))
+
+    async def get_chat_member(self, chat_id: int, user_id: int):
+        return SimpleNamespace(status="member")
+
+    async def dispatch(self, message: FakeMessage) -> bool:
+        """Run the first handler whose filter matches, like Pyrogram's dispatcher."""
+        for flt, func in self._message_handlers:
+            if flt is None or await flt(self, message):
+                await func(self, message)
+                return True
+        return False
+
+class FakePyTgCalls:
+    """py-tgcalls replacement that ends each stream after ``track_seconds``."""
+
+    def __init__(self, track_seconds: float = 5.0, join_latency: float = 0.0):
+        self.track_seconds = track_seconds
+        self.join_latency = join_latency
+        self.calls: Dict[int, Dict[str, Any]] = {}
+        self.plays = 0
+        self._stream_end: Optional[Callable] = None
+        self._group_call_ended: Optional[Callable] = None
+        self._timers: Dict[int, asyncio.TimerHandle] = {}
+
+    def on_stream_end(self, func=None):
+        self._stream_end = func
+        return func
+
+    def on_group_call_ended(self, func=None):
+        self._group_call_ended = func
+        return func
+
+    async def start(self):
+        pass
+
+    async def play(self, chat_id: int, stream=None, config=None):
+        if chat_id not in self.calls and self.join_latency:
+            await asyncio.sleep(self.join_latency)
+        self.calls[chat_id] = {"stream": stream, "paused": False}
+        if stream is None:
+            # Joined without anything to play yet
+            return
+        self.plays += 1
+        self._schedule_end(chat_id)
+
+    async def leave_call(self, chat_id: int):
+        self.calls.pop(chat_id, None)
+        self._cancel_end(chat_id)
+
+    async def pause(self, chat_id: int):
+        self.calls[chat_id]["paused"] = True
+        self._cancel_end(chat_id)
+
+    async def resume(self, chat_id: int):
+        self.calls[chat_id]["paused"] = False
+        self._schedule_end(chat_id)
+
+    async def change_volume_call(self, chat_id: int, volume: int):
+        pass
+
+    async def get_participants(self, chat_id: int):
+        return [SimpleNamespace(user_id=2)]
+
+    def _schedule_end(self, chat_id: int):
+        self._cancel_end(chat_id)
+        if self.track_seconds > 0 and self._stream_end:
+            loop = asyncio.get_running_loop()
+            self._timers[chat_id] = loop.call_later(
+                self.track_seconds,
+                lambda: asyncio.ensure_future(self._stream_end(self, SimpleNamespace(chat_id=chat_id)))
+            )
+
+    def _cancel_end(self, chat_id: int):
+        timer = self._timers.pop(chat_id, None)
+        if timer:
+            timer.cancel()
+
+    def cancel_all(self):
+        for chat_id in list(self._timers):
+            self._cancel_end(chat_id)
+
+class FakeExtractor:
+    """Stand-in for ``yt_dlp.YoutubeDL`` with configurable, jittered latency."""
+
+    def __init__(self, latency: float = 0.5, jitter: float = 0.2, duration: int = 240):
+        self.latency = latency
+        self.jitter = jitter
+        self.duration = duration
+        self.calls = 0
+
+    def _sleep(self):
+        time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter) * self.latency))
+
+    def _video(self, key: str) -> Dict[str, Any]:
+        if "v=" in key:
+            video_id = key.split("v=", 1)[1][:11]
+        else:
+            video_id = hashlib.md5(key.encode()).hexdigest()[:11]
+        return {
+            "id": video_id,
+            "title": f"Track {video_id}",
+            "duration": self.duration,
+            "thumbnail": "",
+            "webpage_url": f"https://www.youtube.com/watch?v={video_id}",
+            "url": f"https://example.invalid/audio/{video_id}",
+            "formats": [
+                {"acodec": "opus", "vcodec": "none", "url": f"https://example.invalid/audio/{video_id}"}
+            ],
+        }
+
+    def extract_info(self, url: str, download: bool = False, **kwargs) -> Dict[str, Any]:
+        self.calls += 1
+        self._sleep()
+        if url.startswith("ytsearch"):
+            prefix, _, query = url.partition(":")
+            limit = int(prefix[len("ytsearch"):] or 1)
+            return {"entries": [self._video(f"{query}#{i}") for i in range(limit)]}
+        return self._video(url)
@@ -0,0 +1,175 @@
+"""Offline load test for the command handlers.
+
+Drives ``handlers.setup_handlers`` with synthetic /play, /skip and /search
+traffic across many chats, using the fakes in ``benchmarks.fakes`` instead
+of Telegram, py-tgcalls and YouTube. No credentials or network are needed.
+
+Usage:
+    python -m benchmarks.run --chats 200 --commands 20 --extract-latency 0.3
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+import tracemalloc
+from collections import defaultdict
+from typing import Dict, List
+
+import handlers
+import youtube
+from admission import admission
+from metrics import ADMISSION_REJECTIONS
+from queues import music_queue
+from sources import register_default_sources
+from stream import MusicPlayer
+from benchmarks.fakes import FakeClient, FakeExtractor, FakeMessage, FakePyTgCalls
+
+QUERIES = [
+    "lofi hip hop", "never gonna give you up", "bohemian rhapsody", "daft punk",
+    "synthwave mix", "classical piano", "jazz standards", "top hits",
+]
+
+def percentile(values: List[float], pct: float) -> float:
+    """Return the ``pct`` percentile of ``values`` (nearest rank)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+def make_command(rng: random.Random, weights: Dict[str, float]) -> str:
+    command = rng.choices(list(weights), weights=list(weights.values()))[0]
+    if command in ("play", "search"):
+        return f"/{command} {rng.choice(QUERIES)} {rng.randint(1, 50)}"
+    return f"/{command}"
+
+async def run(args: argparse.Namespace) -> Dict:
+    rng = random.Random(args.seed)
+    weights = {"play": args.play_weight, "search": args.search_weight, "skip": args.skip_weight}
+
+    if not args.admission:
+        admission.user_rate = admission.chat_rate = 0
+        admission.max_pending = 0
+
+    register_default_sources()
+    extractor = FakeExtractor(latency=args.extract_latency, jitter=args.jitter)
+    for client in youtube.upstream.clients:
+        client.ytdl = dict.fromkeys(youtube.YTDL_MODES, extractor)
+    youtube.upstream.limiter = youtube.RateLimiter(rate=args.extract_rate)
+
+    bot = FakeClient("bench_bot", 1, api_latency=args.api_latency)
+    user = FakeClient("bench_user", 2)
+    calls = FakePyTgCalls(track_seconds=args.track_seconds, join_latency=args.join_latency)
+    player = MusicPlayer(user, py_tgcalls=calls, prejoin=args.prejoin)
+    handlers.setup_handlers(bot, user, player)
+
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors = 0
+
+    async def run_chat(chat_id: int):
+        nonlocal errors
+        chat_rng = random.Random(rng.random())
+        for _ in range(args.commands):
+            text = make_command(chat_rng, weights)
+            message = FakeMessage(bot, chat_id, text, user_id=chat_rng.randint(1000, 1000 + args.users))
+            started = time.perf_counter()
+            try:
+                await bot.dispatch(message)
+            except Exception:
+                errors += 1
+            latencies[text.split()[0][1:]].append(time.perf_counter() - started)
+            if args.think_time:
+                await asyncio.sleep(chat_rng.uniform(0, args.think_time))
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(run_chat(-1000000 - i) for i in range(args.chats)))
+    elapsed = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    calls.cancel_all()
+
+    total = sum(len(values) for values in latencies.values())
+    return {
+        "chats": args.chats,
+        "commands": total,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_per_s": round(total / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            command: {
+                "count": len(values),
+                "p50": round(percentile(values, 50) * 1000, 2),
+                "p99": round(percentile(values, 99) * 1000, 2),
+                "max": round(max(values) * 1000, 2),
+            }
+            for command, values in sorted(latencies.items())
+        },
+        "memory_kib": {"current": current // 1024, "peak": peak // 1024},
+        "rejections": int(sum(ADMISSION_REJECTIONS.values.values())),
+        "extractions": extractor.calls,
+        "telegram_sends": len(bot.sent),
+        "stream_starts": calls.plays,
+        "active_calls": len(player.active_streams),
+        "tracked_queues": len(music_queue.queues),
+    }
+
+def print_report(report: Dict):
+    print(f"Chats: {report['chats']}  Commands: {report['commands']}  Errors: {report['errors']}")
+    print(f"Elapsed: {report['elapsed_s']}s  Throughput: {report['throughput_per_s']} commands/s")
+    print(f"{'command':<10}{'count':>8}{'p50 ms':>12}{'p99 ms':>12}{'max ms':>12}")
+    for command, stats in report["latency_ms"].items():
+        print(f"{command:<10}{stats['count']:>8}{stats['p50']:>12}{stats['p99']:>12}{stats['max']:>12}")
+    print(
+        f"Memory: {report['memory_kib']['current']} KiB current, {report['memory_kib']['peak']} KiB peak"
+    )
+    print(
+        f"Rejected by admission control: {report['rejections']}  "
+        f"Extractions: {report['extractions']}  Telegram sends: {report['telegram_sends']}  "
+        f"Stream starts: {report['stream_starts']}  Active calls: {report['active_calls']}  "
+        f"Tracked queues: {report['tracked_queues']}"
+    )
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Offline load test for the music bot handlers")
+    parser.add_argument("--chats", type=int, default=50, help="number of concurrent chats")
+    parser.add_argument("--commands", type=int, default=20, help="commands sent per chat")
+    parser.add_argument("--users", type=int, default=20, help="distinct requesters per chat")
+    parser.add_argument("--extract-latency", type=float, default=0.3, help="mean fake yt-dlp latency (s)")
+    parser.add_argument(
+        "--extract-rate", type=float, default=0,
+        help="global yt-dlp request limit per minute (0 = unlimited)"
+    )
+    parser.add_argument("--jitter", type=float, default=0.2, help="relative extraction latency jitter")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="fake Telegram API latency (s)")
+    parser.add_argument("--join-latency", type=float, default=0.0, help="fake voice chat join latency (s)")
+    parser.add_argument(
+        "--prejoin", action="store_true",
+        help="join the voice chat while the first song resolves instead of after"
+    )
+    parser.add_argument("--track-seconds", type=float, default=2.0, help="fake track length before stream end (s)")
+    parser.add_argument("--think-time", type=float, default=0.0, help="max pause between commands in a chat (s)")
+    parser.add_argument("--play-weight", type=float, default=0.6)
+    parser.add_argument("--search-weight", type=float, default=0.25)
+    parser.add_argument("--skip-weight", type=float, default=0.15)
+    parser.add_argument(
+        "--no-admission", dest="admission", action="store_false",
+        help="disable per-user/per-chat rate limits to measure raw capacity"
+    )
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    report = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+if __name__ == "__main__":
+    main()
@@ -7,23 +7,151 @@ API_HASH = os.environ.get('API_HASH', '')
 BOT_TOKEN = os.environ.get('BOT_TOKEN', '')
 SESSION_STRING = os.environ.get('SESSION_STRING', '')
 
+# User IDs allowed to run admin-only commands such as /debug
+ADMIN_IDS = {int(user_id) for user_id in os.environ.get('ADMIN_IDS', '').split(',') if user_id.strip()}
+
 # Music configuration
 MAX_PLAYLIST_SIZE = 50
+FAIR_QUEUE = os.environ.get('FAIR_QUEUE', 'false').lower() == 'true'  # round-robin across requesters
+MAX_SONGS_PER_USER = int(os.environ.get('MAX_SONGS_PER_USER', 0))  # 0 = no per-user quota
 DURATION_LIMIT = 180  # in minutes
 DEFAULT_VOLUME = 100
 
+# Playback rules checked on search results and cached metadata before full extraction
+ALLOW_LIVE = os.environ.get('ALLOW_LIVE', 'true').lower() == 'true'
+BLOCK_AGE_RESTRICTED = os.environ.get('BLOCK_AGE_RESTRICTED', 'true').lower() == 'true'
+
+# Live streams: re-resolve the manifest this many seconds before it expires, and
+# how many times in a row a dropped live stream is restarted before giving up
+LIVE_REFRESH_MARGIN = int(os.environ.get('LIVE_REFRESH_MARGIN', 300))
+LIVE_MAX_RECONNECTS = int(os.environ.get('LIVE_MAX_RECONNECTS', 5))
+
+# Per-video metadata cache used for those checks
+METADATA_CACHE_SIZE = int(os.environ.get('METADATA_CACHE_SIZE', 2000))
+METADATA_CACHE_TTL = int(os.environ.get('METADATA_CACHE_TTL', 6 * 3600))  # in seconds
+
+# Song sources: search order (later ones are tried when earlier ones find nothing or fail),
+# how many resolved stream URLs to reuse, and how long before they expire to stop reusing them
+SEARCH_SOURCES = [name.strip() for name in os.environ.get('SEARCH_SOURCES', 'youtube,soundcloud').split(',') if name.strip()]
+RESOLVE_CACHE_SIZE = int(os.environ.get('RESOLVE_CACHE_SIZE', 500))
+RESOLVE_EXPIRY_MARGIN = int(os.environ.get('RESOLVE_EXPIRY_MARGIN', 1800))  # in seconds
+LOCAL_MUSIC_DIR = os.environ.get('LOCAL_MUSIC_DIR', '')  # empty disables local: files
+# Let links to private, loopback and link-local addresses be played (only for trusted chats)
+ALLOW_PRIVATE_LINKS = os.environ.get('ALLOW_PRIVATE_LINKS', 'false').lower() == 'true'
+
+# Search results cache: fresh for SEARCH_CACHE_TTL seconds, then served stale and
+# refreshed in the background for up to SEARCH_STALE_GRACE more seconds
+SEARCH_CACHE_SIZE = int(os.environ.get('SEARCH_CACHE_SIZE', 1000))
+SEARCH_CACHE_TTL = int(os.environ.get('SEARCH_CACHE_TTL', 3600))
+SEARCH_STALE_GRACE = int(os.environ.get('SEARCH_STALE_GRACE', 24 * 3600))
+
+# Cache for audio files sent in Telegram, played once this much of a file is downloaded
+FILE_CACHE_DIR = os.environ.get('FILE_CACHE_DIR', 'downloads')
+FILE_CACHE_MAX_MB = int(os.environ.get('FILE_CACHE_MAX_MB', 1024))
+FILE_PREBUFFER_KB = int(os.environ.get('FILE_PREBUFFER_KB', 512))
+
+# Play history log (empty disables it) and the popularity scores built from it
+HISTORY_PATH = os.environ.get('HISTORY_PATH', 'play_history.log')
+HISTORY_MAX_LINES = int(os.environ.get('HISTORY_MAX_LINES', 100000))
+POPULARITY_HALF_LIFE = int(os.environ.get('POPULARITY_HALF_LIFE', 7 * 24 * 3600))  # in seconds
+POPULARITY_MAX_TRACKS = int(os.environ.get('POPULARITY_MAX_TRACKS', 5000))
+
+# Cache warmer: keep the most popular tracks resolved and their files cached (0 disables)
+WARM_INTERVAL = int(os.environ.get('WARM_INTERVAL', 900))  # in seconds
+WARM_TOP_K = int(os.environ.get('WARM_TOP_K', 50))
+
+# Autoplay: keep playing related tracks when the queue runs dry (per-chat /autoplay overrides
+# the default), for at most this many tracks in a row without a user request
+AUTOPLAY = os.environ.get('AUTOPLAY', 'false').lower() == 'true'
+AUTOPLAY_MAX_TRACKS = int(os.environ.get('AUTOPLAY_MAX_TRACKS', 10))
+
+# Audio effects: loudness normalization for new chats (per-chat /normalize overrides it) and its
+# target in LUFS, where track loudness measurements are kept, plays of a track with the same
+# effects before a filtered copy is rendered to the file cache (0 disables), and how many
+# ffmpeg analysis/render jobs run at once
+EFFECTS_NORMALIZE = os.environ.get('EFFECTS_NORMALIZE', 'false').lower() == 'true'
+LOUDNESS_TARGET = float(os.environ.get('LOUDNESS_TARGET', -16))
+LOUDNESS_CACHE_PATH = os.environ.get('LOUDNESS_CACHE_PATH', 'loudness.json')
+LOUDNESS_CACHE_SIZE = int(os.environ.get('LOUDNESS_CACHE_SIZE', 20000))
+EFFECTS_RENDER_AFTER = int(os.environ.get('EFFECTS_RENDER_AFTER', 3))
+EFFECTS_WORKERS = int(os.environ.get('EFFECTS_WORKERS', 2))
+
+# Voice chat checks: seconds a chat's voice chat state is trusted (0 disables the check before
+# extraction) and the shorter time for chats found without one; with PREJOIN, /play joins the
+# voice chat while the song is still being resolved
+GROUP_CALL_TTL = float(os.environ.get('GROUP_CALL_TTL', 300))
+GROUP_CALL_NEGATIVE_TTL = float(os.environ.get('GROUP_CALL_NEGATIVE_TTL', 15))
+PREJOIN = os.environ.get('PREJOIN', 'false').lower() == 'true'
+
+# Number of threads running yt-dlp extractions
+EXTRACTOR_WORKERS = int(os.environ.get('EXTRACTOR_WORKERS', 8))
+
+# Upstream health: requests per minute across all yt-dlp extractions (halved on throttling,
+# 0 disables), failures in a row before a source is paused, and the pause backoff in seconds
+EXTRACT_RATE_LIMIT = float(os.environ.get('EXTRACT_RATE_LIMIT', 300))
+EXTRACT_BURST = int(os.environ.get('EXTRACT_BURST', 20))
+BREAKER_THRESHOLD = int(os.environ.get('BREAKER_THRESHOLD', 3))
+BACKOFF_BASE = float(os.environ.get('BACKOFF_BASE', 30))
+BACKOFF_MAX = float(os.environ.get('BACKOFF_MAX', 600))
+# Local IPs yt-dlp requests are spread over; a throttled address is skipped until it recovers
+SOURCE_ADDRESSES = [address.strip() for address in os.environ.get('SOURCE_ADDRESSES', '0.0.0.0').split(',') if address.strip()] or ['0.0.0.0']
+
+# Idle reaper configuration (in seconds, 0 disables a check)
+REAPER_INTERVAL = int(os.environ.get('REAPER_INTERVAL', 60))
+IDLE_TIMEOUT = int(os.environ.get('IDLE_TIMEOUT', 300))
+PAUSED_TIMEOUT = int(os.environ.get('PAUSED_TIMEOUT', 900))
+NO_LISTENER_TIMEOUT = int(os.environ.get('NO_LISTENER_TIMEOUT', 120))
+PREJOIN_TIMEOUT = int(os.environ.get('PREJOIN_TIMEOUT', 120))
+
+# Admission control for /play and /search (rates are per minute, 0 disables a limit)
+USER_RATE_LIMIT = float(os.environ.get('USER_RATE_LIMIT', 6))
+USER_BURST = int(os.environ.get('USER_BURST', 3))
+CHAT_RATE_LIMIT = float(os.environ.get('CHAT_RATE_LIMIT', 20))
+CHAT_BURST = int(os.environ.get('CHAT_BURST', 10))
+MAX_CONCURRENT_RESOLVES = int(os.environ.get('MAX_CONCURRENT_RESOLVES', 16))
+MAX_PENDING_RESOLVES = int(os.environ.get('MAX_PENDING_RESOLVES', 64))
+
+# Seconds an idle per-chat command actor is kept before it exits
+ACTOR_IDLE_TIMEOUT = float(os.environ.get('ACTOR_IDLE_TIMEOUT', 60))
+
+# Metrics endpoint (set METRICS_PORT=0 to disable)
+METRICS_HOST = os.environ.get('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 9100))
+
+# Event-loop monitoring (set SLOW_CALLBACK_THRESHOLD=0 to disable stack reports)
+LOOP_LAG_INTERVAL = float(os.environ.get('LOOP_LAG_INTERVAL', 0.5))
+SLOW_CALLBACK_THRESHOLD = float(os.environ.get('SLOW_CALLBACK_THRESHOLD', 0.25))
+ASYNCIO_DEBUG = os.environ.get('ASYNCIO_DEBUG', 'false').lower() == 'true'
+
+# Request tracing
+TRACE_BUFFER_SIZE = int(os.environ.get('TRACE_BUFFER_SIZE', 200))
+TRACE_LOG_ENABLED = os.environ.get('TRACE_LOG_ENABLED', 'true').lower() == 'true'
+TRACE_OTLP_ENDPOINT = os.environ.get('TRACE_OTLP_ENDPOINT', '')  # e.g. http://127.0.0.1:4318/v1/traces
+
+# Graceful shutdown: the whole shutdown has to fit in the platform's grace period (Heroku
+# kills the process 30s after SIGTERM); draining in-flight requests gets part of it
+SHUTDOWN_TIMEOUT = float(os.environ.get('SHUTDOWN_TIMEOUT', 25))
+SHUTDOWN_DRAIN_TIMEOUT = float(os.environ.get('SHUTDOWN_DRAIN_TIMEOUT', 10))
+QUEUE_SNAPSHOT_PATH = os.environ.get('QUEUE_SNAPSHOT_PATH', 'queue_snapshot.json')
+# Older snapshots aren't restored on start; their stream links have likely expired
+QUEUE_SNAPSHOT_MAX_AGE = float(os.environ.get('QUEUE_SNAPSHOT_MAX_AGE', 3600))
+
 # Messages
 MESSAGES = {
     "start": "👋 Hi! I'm a Music Bot powered by Pyrogram and Py-TgCalls.\n\nUse /help to see available commands.",
     "help": """🎵 **Available Commands**:
 
 **Music Commands**
-• /play [song name/link] - Play song from YouTube
-• /search [query] - Search for a song on YouTube
+• /play [song name/link] - Play a song from YouTube, SoundCloud, a live stream or a radio/audio link (or reply to an audio file)
+• /search [query] - Search for a song
 
 **Queue Commands**
 • /queue - Show current queue
-• /skip - Skip current song
+• /skip [count] - Skip current song (or several)
+• /jump [position] - Play a queued song now
+• /remove [position|from-to] - Remove songs from the queue
+• /move [from] [to] - Move a song in the queue
+• /shuffle - Shuffle the queue
 • /clear - Clear the queue
 
 **Player Controls**
@@ -31,6 +159,14 @@ MESSAGES = {
 • /resume - Resume playback
 • /stop - Stop playback
 • /volume [1-200] - Adjust volume
+• /autoplay [on|off] - Keep playing related songs when the queue ends
+
+**Audio Effects**
+• /speed [0.5-2.0] - Change playback speed
+• /pitch [-12-12] - Shift pitch by semitones
+• /bass [0-20] - Boost bass by dB
+• /normalize [on|off] - Even out loudness between songs
+• /effects [reset] - Show or reset the current effects
 
 **Other Commands**
 • /ping - Check bot response time
@@ -48,15 +184,37 @@ MESSAGES = {
     "no_songs_in_queue": "❌ **No songs in queue!**",
     "queue_cleared": "🗑 **Queue cleared!**",
     "song_skipped": "⏭ **Song skipped!**",
+    "songs_skipped": "⏭ **Skipped {count} songs!**",
+    "jumped": "⏭ **Jumped to:** {title}",
+    "removed": "🗑 **Removed {count} song(s) from the queue!**",
+    "moved": "↕️ **Moved song #{old} to #{new}!**",
+    "shuffled": "🔀 **Queue shuffled!**",
+    "rate_limited": "⏳ **Slow down!** Try again in {seconds}s.",
+    "busy": "🚦 **I'm busy right now, please try again in a moment!**",
+    "user_quota": "❌ **You already have {limit} songs in the queue!** Wait for some to play first.",
+    "too_long": "❌ **Songs longer than {limit} minutes are not allowed!**\n**Requested song duration:** {duration}",
+    "live_not_allowed": "❌ **Live streams are not allowed!**",
+    "live_not_started": "⏳ **This live stream hasn't started yet!**",
+    "age_restricted": "❌ **Age-restricted videos can't be played!**",
+    "invalid_position": "❌ **Invalid queue position!**",
     "playback_paused": "⏸ **Playback paused!**",
     "playback_resumed": "▶️ **Playback resumed!**",
     "playback_stopped": "⏹ **Playback stopped!**",
     "volume_set": "🔊 **Volume set to:** {volume}%",
+    "autoplay_on": "📻 **Autoplay on!** Related songs will keep playing when the queue ends.",
+    "autoplay_off": "📻 **Autoplay off!**",
+    "effects": "🎛 **Effects:** {effects}",
+    "effects_set": "🎛 **Effects set:** {effects}",
+    "effects_reset": "🎛 **Effects reset!**",
+    "invalid_effect": "❌ **{error}**\n**Usage:** {usage}",
     "processing": "⏳ **Processing...**",
     "extracting_info": "📥 **Extracting information...**",
     "downloading": "📥 **Downloading audio...**",
     "error": "❌ **Error:** {error}",
     "ping": "🏓 **Pong!** `{time_taken}ms`",
+    "shutting_down": "🔄 **The bot is restarting, please try again in a moment!**",
+    "admin_only": "❌ **This command is restricted to bot admins!**",
+    "no_traces": "❌ **No requests have been traced yet!**",
 }
 
 # Active voice chats (chat_id: call_info)
@@ -0,0 +1,342 @@
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import os
+import shlex
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from config import (
+    EFFECTS_NORMALIZE,
+    LOUDNESS_TARGET,
+    LOUDNESS_CACHE_PATH,
+    LOUDNESS_CACHE_SIZE,
+    EFFECTS_RENDER_AFTER,
+    EFFECTS_WORKERS,
+)
+from filecache import file_cache
+from history import track_key
+from metrics import EFFECTS_JOBS
+from tracing import span
+
+logger = logging.getLogger("effects")
+
+# Allowed settings
+SPEED_RANGE = (0.5, 2.0)
+PITCH_RANGE = (-12, 12)  # semitones
+BASS_RANGE = (0, 20)  # dB
+
+# Sample rate filters work at, so asetrate can shift pitch by an exact factor
+FILTER_SAMPLE_RATE = 48000
+
+# A loudness analysis decodes the whole track; give up on it after this long
+ANALYSIS_TIMEOUT = 180
+
+# New measurements are written out together, this long after the first unsaved one
+SAVE_DELAY = 60
+
+# Cache label for rendered copies, apart from Telegram uploads in the same file cache
+RENDER_CACHE = "effects_render"
+
+class Effects:
+    """Audio filter settings for one chat."""
+    __slots__ = ("normalize", "speed", "pitch", "bass")
+
+    def __init__(self, normalize: bool = EFFECTS_NORMALIZE, speed: float = 1.0, pitch: int = 0, bass: int = 0):
+        self.normalize = normalize
+        self.speed = speed
+        self.pitch = pitch
+        self.bass = bass
+
+    def is_plain(self) -> bool:
+        return not self.normalize and self.speed == 1.0 and not self.pitch and not self.bass
+
+    def describe(self) -> str:
+        parts = []
+        if self.normalize:
+            parts.append("normalized")
+        if self.speed != 1.0:
+            parts.append(f"speed {self.speed:g}x")
+        if self.pitch:
+            parts.append(f"pitch {self.pitch:+d}")
+        if self.bass:
+            parts.append(f"bass +{self.bass}dB")
+        return ", ".join(parts) or "none"
+
+def _atempo(factor: float) -> list:
+    """Chain atempo filters, each limited to 0.5-2.0."""
+    filters = []
+    while factor > 2.0:
+        filters.append("atempo=2.0")
+        factor /= 2.0
+    while factor < 0.5:
+        filters.append("atempo=0.5")
+        factor /= 0.5
+    if abs(factor - 1.0) > 1e-6:
+        filters.append(f"atempo={factor:.6g}")
+    return filters
+
+def filter_chain(effects: Effects, loudness: Optional[Dict[str, float]] = None, live: bool = False) -> Optional[str]:
+    """Build the ffmpeg ``-af`` filter graph for a chat's effects, or None if there is nothing to do.
+
+    With a cached loudness analysis normalization runs in linear mode, a
+    plain gain change; otherwise loudnorm adjusts dynamically as it plays.
+    Live streams have no timeline to stretch, so speed and pitch are ignored.
+    """
+    filters = []
+    if effects.normalize:
+        loudnorm = f"loudnorm=I={LOUDNESS_TARGET}:TP=-1.5:LRA=11"
+        if loudness:
+            loudnorm += (
+                f":measured_I={loudness['input_i']}:measured_TP={loudness['input_tp']}"
+                f":measured_LRA={loudness['input_lra']}:measured_thresh={loudness['input_thresh']}"
+                f":offset={loudness['target_offset']}:linear=true"
+            )
+        filters.append(loudnorm)
+
+    if not live and (effects.speed != 1.0 or effects.pitch):
+        # Shift pitch by resampling, then undo the tempo change it causes
+        pitch = 2 ** (effects.pitch / 12)
+        filters.append(f"aresample={FILTER_SAMPLE_RATE}")
+        if effects.pitch:
+            filters.append(f"asetrate={FILTER_SAMPLE_RATE * pitch:.0f}")
+            filters.append(f"aresample={FILTER_SAMPLE_RATE}")
+        filters.extend(_atempo(effects.speed / pitch))
+
+    if effects.bass:
+        filters.append(f"bass=g={effects.bass}:f=110:w=0.6")
+        filters.append("alimiter=limit=0.95")
+
+    return ",".join(filters) or None
+
+def tempo(effects: Effects, live: bool = False) -> float:
+    """Seconds of the original track played per second of output."""
+    return 1.0 if live else effects.speed
+
+class LoudnessCache:
+    """Loudness measurements per track, kept in a JSON file across restarts."""
+
+    def __init__(self, path: str = LOUDNESS_CACHE_PATH, max_size: int = LOUDNESS_CACHE_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self.entries: "OrderedDict[str, Dict[str, float]]" = OrderedDict()
+        self.dirty = False
+        self._loaded = False
+
+    def _load(self):
+        self._loaded = True
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                self.entries.update(json.load(f))
+        except (OSError, ValueError) as e:
+            logger.error(f"Error loading loudness cache: {e}")
+
+    def get(self, track: str) -> Optional[Dict[str, float]]:
+        if not self._loaded:
+            self._load()
+        return self.entries.get(track)
+
+    def put(self, track: str, loudness: Dict[str, float]):
+        self.entries[track] = loudness
+        self.entries.move_to_end(track)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+        self.dirty = True
+
+    def save(self, entries: Dict[str, Dict[str, float]]):
+        """Write a copy of the entries to disk. Blocking; run it off the event loop."""
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, self.path)
+
+class AudioEffects:
+    """Per-chat audio filters, loudness analysis and rendered copies of popular tracks.
+
+    A track played with the same effects ``EFFECTS_RENDER_AFTER`` times is
+    rendered once into the file cache, and later plays stream that copy
+    instead of filtering on the fly.
+    """
+
+    def __init__(self, render_after: int = EFFECTS_RENDER_AFTER, workers: int = EFFECTS_WORKERS):
+        self.chats: Dict[int, Effects] = {}
+        self.loudness = LoudnessCache()
+        self.render_after = render_after
+        self.plays: Counter = Counter()
+        self._semaphore = asyncio.Semaphore(max(1, workers))
+        self._jobs: Dict[str, asyncio.Task] = {}
+        self._save_task: Optional[asyncio.Task] = None
+
+    def get(self, chat_id: int) -> Effects:
+        return self.chats.get(chat_id) or Effects()
+
+    def update(self, chat_id: int, **changes) -> Effects:
+        """Change some of a chat's effects; raises ValueError for out-of-range values."""
+        effects = self.get(chat_id)
+        effects = Effects(effects.normalize, effects.speed, effects.pitch, effects.bass)
+        for name, value in changes.items():
+            if name == "speed" and not SPEED_RANGE[0] <= value <= SPEED_RANGE[1]:
+                raise ValueError(f"Speed must be between {SPEED_RANGE[0]:g} and {SPEED_RANGE[1]:g}!")
+            if name == "pitch" and not PITCH_RANGE[0] <= value <= PITCH_RANGE[1]:
+                raise ValueError(f"Pitch must be between {PITCH_RANGE[0]} and {PITCH_RANGE[1]} semitones!")
+            if name == "bass" and not BASS_RANGE[0] <= value <= BASS_RANGE[1]:
+                raise ValueError(f"Bass boost must be between {BASS_RANGE[0]} and {BASS_RANGE[1]} dB!")
+            setattr(effects, name, value)
+        self.chats[chat_id] = effects
+        return effects
+
+    def reset(self, chat_id: int) -> Effects:
+        self.chats.pop(chat_id, None)
+        return self.get(chat_id)
+
+    def _variant_key(self, track: str, chain: str) -> str:
+        return "fx" + hashlib.sha1(f"{track}|{chain}".encode()).hexdigest()[:24]
+
+    def stream_input(
+        self, chat_id: int, song_info: Dict[str, Any], audio_url: str, position: float = 0.0
+    ) -> Tuple[str, Optional[str]]:
+        """Return what to play for a song and the ffmpeg parameters for it.
+
+        ``position`` is where to start, in seconds of the original track.
+        """
+        live = bool(song_info.get("is_live"))
+        position = 0.0 if live else max(0.0, position)
+        effects = self.get(chat_id)
+        track = track_key(song_info)
+        chain = None if effects.is_plain() else filter_chain(
+            effects, self.loudness.get(track) if track else None, live
+        )
+
+        if chain and track and not live:
+            variant = file_cache.get_path(self._variant_key(track, chain), cache=RENDER_CACHE)
+            if variant:
+                # The rendered copy already runs at the chosen speed
+                return variant, f"-ss {position / tempo(effects):.3f}" if position else None
+
+        parameters = []
+        if position:
+            parameters.append(f"-ss {position:.3f}")
+        if chain:
+            parameters.append(f"-atmid -af {shlex.quote(chain)}")
+        return audio_url, " ".join(parameters) or None
+
+    def played(self, chat_id: int, song_info: Dict[str, Any], audio_url: str):
+        """Start the background work a song played with effects calls for."""
+        track = track_key(song_info)
+        effects = self.get(chat_id)
+        if track is None or song_info.get("is_live") or effects.is_plain():
+            return
+
+        # An upload still downloading would be measured or rendered cut short; a later play does it
+        complete = not file_cache.is_downloading(audio_url)
+
+        loudness = self.loudness.get(track)
+        if effects.normalize and loudness is None:
+            if complete:
+                self._start(f"analyze:{track}", self._analyze(track, audio_url))
+            # Render once the measurement makes the chain final
+            return
+
+        chain = filter_chain(effects, loudness)
+        key = self._variant_key(track, chain)
+        self.plays[key] += 1
+        if (
+            complete and self.render_after and self.plays[key] >= self.render_after
+            and not file_cache.get_path(key, cache=RENDER_CACHE)
+        ):
+            self._start(f"render:{key}", self._render(key, audio_url, chain))
+
+    def _start(self, name: str, coro):
+        if name in self._jobs:
+            coro.close()
+            return
+        task = asyncio.create_task(coro, name=name)
+        self._jobs[name] = task
+        task.add_done_callback(lambda _: self._jobs.pop(name, None))
+
+    async def _analyze(self, track: str, audio_url: str):
+        """Measure a track's loudness with a loudnorm analysis pass."""
+        async with self._semaphore:
+            started = time.perf_counter()
+            process = None
+            try:
+                with span("effects.analyze", track=track):
+                    process = await asyncio.create_subprocess_exec(
+                        "ffmpeg", "-hide_banner", "-nostats", "-nostdin", "-i", audio_url, "-vn",
+                        "-af", f"loudnorm=I={LOUDNESS_TARGET}:TP=-1.5:LRA=11:print_format=json", "-f", "null", "-",
+                        stdout=asyncio.subprocess.DEVNULL,
+                        stderr=asyncio.subprocess.PIPE,
+                    )
+                    _, stderr = await asyncio.wait_for(process.communicate(), ANALYSIS_TIMEOUT)
+
+                # The measurement is the last JSON object ffmpeg prints
+                output = stderr.decode(errors="replace")
+                measured = json.loads(output[output.rindex("{"):output.rindex("}") + 1])
+                loudness = {
+                    field: float(measured[field])
+                    for field in ("input_i", "input_tp", "input_lra", "input_thresh", "target_offset")
+                }
+                if not all(math.isfinite(value) for value in loudness.values()):
+                    raise ValueError("silent track")
+
+            except asyncio.CancelledError:
+                if process is not None and process.returncode is None:
+                    process.kill()
+                raise
+
+            except Exception as e:
+                if process is not None and process.returncode is None:
+                    process.kill()
+                logger.error(f"Error analyzing loudness of {track}: {e}")
+                EFFECTS_JOBS.inc(job="analyze", result="error")
+                return
+
+        self.loudness.put(track, loudness)
+        if self._save_task is None:
+            self._save_task = asyncio.create_task(self._save_later())
+        EFFECTS_JOBS.inc(job="analyze", result="ok")
+        logger.info(f"Measured {track} at {loudness['input_i']} LUFS in {time.perf_counter() - started:.1f}s")
+
+    async def _render(self, key: str, audio_url: str, chain: str):
+        """Render a track with a filter chain into the file cache."""
+        async with self._semaphore:
+            path = await file_cache.render(
+                key, ["-i", audio_url, "-vn", "-af", chain, "-c:a", "libopus", "-b:a", "128k", "-f", "ogg"]
+            )
+        EFFECTS_JOBS.inc(job="render", result="ok" if path else "error")
+
+    async def _save_later(self):
+        await asyncio.sleep(SAVE_DELAY)
+        self._save_task = None
+        await self._save()
+
+    async def _save(self):
+        """Write the loudness cache if it has unsaved measurements."""
+        if not self.loudness.dirty:
+            return
+        self.loudness.dirty = False
+        try:
+            await asyncio.to_thread(self.loudness.save, dict(self.loudness.entries))
+        except OSError as e:
+            self.loudness.dirty = True
+            logger.error(f"Error saving loudness cache: {e}")
+
+    async def stop(self):
+        """Cancel analyses and renders in progress and save pending measurements."""
+        for task in list(self._jobs.values()):
+            task.cancel()
+        await asyncio.gather(*self._jobs.values(), return_exceptions=True)
+        if self._save_task is not None:
+            self._save_task.cancel()
+            self._save_task = None
+        await self._save()
+
+# Create global audio effects instance
+audio_effects = AudioEffects()
@@ -0,0 +1,307 @@
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from pyrogram import Client
+from pyrogram.types import Message
+
+from config import FILE_CACHE_DIR, FILE_CACHE_MAX_MB, FILE_PREBUFFER_KB
+from metrics import record_cache
+from queues import music_queue
+from tracing import span
+
+logger = logging.getLogger("filecache")
+
+# Containers ffmpeg can play while they are still being written. Anything else
+# (MP4/M4A keep their index at the end) is only played once fully downloaded.
+STREAMABLE_MIME_TYPES = {
+    "audio/mpeg", "audio/mp3", "audio/ogg", "audio/opus", "audio/flac", "audio/x-flac",
+    "audio/wav", "audio/x-wav", "audio/aac", "audio/webm", "video/webm",
+}
+
+def get_media(message: Message) -> Optional[Any]:
+    """Return the audio, voice note or audio/video document attached to a message."""
+    if message.audio:
+        return message.audio
+    if message.voice:
+        return message.voice
+
+    document = message.document
+    if document and (document.mime_type or "").startswith(("audio/", "video/")):
+        return document
+
+    return None
+
+def media_info(message: Message, media: Any) -> Dict[str, Any]:
+    """Build song metadata for a Telegram upload, without downloading it."""
+    if message.voice:
+        title = "Voice note"
+    else:
+        title = " - ".join(filter(None, (getattr(media, "performer", None), getattr(media, "title", None))))
+        title = title or getattr(media, "file_name", None) or "Telegram audio"
+
+    return {
+        "id": media.file_unique_id,
+        "title": title,
+        "duration": getattr(media, "duration", None),
+        "thumbnail": "",
+        "webpage_url": message.link,
+        "source": "telegram",
+    }
+
+def _write(file, chunk: bytes):
+    file.write(chunk)
+    file.flush()
+
+class CachedFile:
+    """A cached download; ``ready`` resolves once enough of it is on disk to play,
+    ``complete`` to whether the whole file arrived."""
+    __slots__ = ("key", "path", "size", "done", "ready", "complete")
+
+    def __init__(self, key: str, path: str, size: int, done: bool = False):
+        self.key = key
+        self.path = path
+        self.size = size
+        self.done = done
+        loop = asyncio.get_running_loop()
+        self.ready: asyncio.Future = loop.create_future()
+        self.complete: asyncio.Future = loop.create_future()
+        if done:
+            self.ready.set_result(None)
+            self.complete.set_result(True)
+
+class FileCache:
+    """Size-capped LRU of Telegram files on disk, keyed by ``file_unique_id``.
+
+    Files are named ``<file_unique_id>-<size>`` so complete downloads from a
+    previous run can be told apart from interrupted ones.
+    """
+
+    def __init__(
+        self,
+        directory: str = FILE_CACHE_DIR,
+        max_bytes: int = FILE_CACHE_MAX_MB * 1024 * 1024,
+        prebuffer: int = FILE_PREBUFFER_KB * 1024
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.prebuffer = prebuffer
+        self.entries: "OrderedDict[str, CachedFile]" = OrderedDict()
+        self.total_bytes = 0
+        self.downloading: Dict[str, CachedFile] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._loaded = False
+
+    def _load(self):
+        """Index files left by a previous run, oldest first, and drop partial ones."""
+        os.makedirs(self.directory, exist_ok=True)
+        paths = [os.path.join(self.directory, name) for name in os.listdir(self.directory)]
+        for path in sorted(paths, key=os.path.getmtime):
+            key, _, size = os.path.basename(path).rpartition("-")
+            if not key or not size.isdigit() or os.path.getsize(path) != int(size):
+                os.remove(path)
+                continue
+            self.entries[key] = CachedFile(key, path, int(size), done=True)
+            self.total_bytes += int(size)
+        self._loaded = True
+        self._evict()
+
+    def _evict(self):
+        """Delete least recently used files until the cache fits; never active downloads or queued songs."""
+        pinned = None
+        for key in list(self.entries):
+            if self.total_bytes <= self.max_bytes:
+                break
+            entry = self.entries[key]
+            if not entry.done:
+                continue
+            if pinned is None:
+                pinned = {
+                    song.get("audio_url") for queue in music_queue.queues.values() for song in queue
+                }
+            if entry.path in pinned:
+                continue
+            del self.entries[key]
+            self.total_bytes -= entry.size
+            try:
+                os.remove(entry.path)
+            except OSError as e:
+                logger.error(f"Error evicting {entry.path}: {e}")
+
+    def is_downloading(self, path: str) -> bool:
+        """Check if a file is still being written, so ffmpeg has to follow it."""
+        return path in self.downloading
+
+    async def wait_downloaded(self, path: str) -> bool:
+        """Wait for a file being written; True once it is complete, False if it failed or wasn't downloading."""
+        entry = self.downloading.get(path)
+        if entry is None:
+            return False
+        return await asyncio.shield(entry.complete)
+
+    def touch(self, key: str) -> bool:
+        """Mark a cached file as just used so eviction keeps it; False if it isn't cached."""
+        if not self._loaded:
+            self._load()
+
+        entry = self.entries.get(key)
+        if entry is None:
+            return False
+
+        self.entries.move_to_end(key)
+        if entry.done:
+            os.utime(entry.path)
+        return True
+
+    def get_path(self, key: str, cache: str = "file") -> Optional[str]:
+        """Return the path of a fully cached file, or None; the lookup is counted under ``cache``."""
+        if not self._loaded:
+            self._load()
+
+        entry = self.entries.get(key)
+        record_cache(cache, entry is not None and entry.done)
+        if entry is None or not entry.done:
+            return None
+
+        self.entries.move_to_end(key)
+        return entry.path
+
+    async def render(self, key: str, ffmpeg_args: List[str]) -> Optional[str]:
+        """Cache the output of ``ffmpeg <ffmpeg_args> <file>`` under ``key`` and return its path.
+
+        Used for processed copies of tracks; the file is only indexed once
+        ffmpeg has finished, so a failed render leaves nothing behind.
+        """
+        if not self._loaded:
+            self._load()
+        if key in self.entries:
+            entry = self.entries[key]
+            return entry.path if entry.done else None
+
+        tmp_path = os.path.join(self.directory, f"{key}.part")
+        process = None
+        try:
+            with span("filecache.render", key=key):
+                process = await asyncio.create_subprocess_exec(
+                    "ffmpeg", "-hide_banner", "-loglevel", "error", "-nostdin", "-y", *ffmpeg_args, tmp_path,
+                    stdout=asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.PIPE,
+                )
+                _, stderr = await process.communicate()
+            if process.returncode != 0:
+                raise RuntimeError(stderr.decode(errors="replace").strip()[-300:])
+
+            size = os.path.getsize(tmp_path)
+            if size > self.max_bytes:
+                raise RuntimeError(f"rendered file is too large ({size // (1024 * 1024)} MB)")
+            path = os.path.join(self.directory, f"{key}-{size}")
+            os.replace(tmp_path, path)
+
+        except asyncio.CancelledError:
+            if process is not None and process.returncode is None:
+                process.kill()
+            self._remove(tmp_path)
+            raise
+
+        except Exception as e:
+            logger.error(f"Error rendering {key}: {e}")
+            self._remove(tmp_path)
+            return None
+
+        self.entries[key] = CachedFile(key, path, size, done=True)
+        self.total_bytes += size
+        self._evict()
+        logger.info(f"Rendered {key} ({size} bytes)")
+        return path
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    async def fetch(self, client: Client, media: Any) -> Tuple[Optional[Dict], Optional[str]]:
+        """Return ``(info, path)`` for a Telegram file, downloading it on first use.
+
+        Returns once the prebuffer is on disk; the rest keeps downloading in the
+        background. On failure returns ``(None, error)`` like ``get_audio_url``.
+        """
+        if not self._loaded:
+            self._load()
+
+        size = media.file_size or 0
+        if size > self.max_bytes:
+            return None, f"File is too large ({size // (1024 * 1024)} MB)"
+
+        key = media.file_unique_id
+        entry = self.entries.get(key)
+        record_cache("file", entry is not None)
+
+        if entry is None:
+            entry = CachedFile(key, os.path.join(self.directory, f"{key}-{size}"), size)
+            self.entries[key] = entry
+            self.total_bytes += size
+            self._evict()
+
+            streamable = getattr(media, "mime_type", None) in STREAMABLE_MIME_TYPES
+            task = asyncio.create_task(self._download(client, media, entry, streamable))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        else:
+            self.entries.move_to_end(key)
+            if entry.done:
+                # Keep the on-disk order in step for the next start
+                os.utime(entry.path)
+
+        try:
+            with span("filecache.prebuffer", size=size):
+                await asyncio.shield(entry.ready)
+        except Exception as e:
+            return None, f"Error: {str(e)}"
+
+        return {"protocol": "file"}, entry.path
+
+    async def _download(self, client: Client, media: Any, entry: CachedFile, streamable: bool):
+        self.downloading[entry.path] = entry
+        written = 0
+        try:
+            with open(entry.path, "wb") as file:
+                async for chunk in client.stream_media(media.file_id):
+                    await asyncio.to_thread(_write, file, chunk)
+                    written += len(chunk)
+                    if streamable and written >= self.prebuffer and not entry.ready.done():
+                        entry.ready.set_result(None)
+
+            entry.done = True
+            if not entry.ready.done():
+                entry.ready.set_result(None)
+            logger.info(f"Cached {entry.key} ({written} bytes)")
+
+        except Exception as e:
+            logger.error(f"Error downloading {entry.key}: {e}")
+            if self.entries.get(entry.key) is entry:
+                del self.entries[entry.key]
+                self.total_bytes -= entry.size
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+            if not entry.ready.done():
+                entry.ready.set_exception(e)
+
+        finally:
+            self.downloading.pop(entry.path, None)
+            if not entry.complete.done():
+                entry.complete.set_result(entry.done)
+
+    async def stop(self):
+        """Cancel downloads in progress; their partial files are dropped on next start."""
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+# Create global file cache instance
+file_cache = FileCache()
@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Optional, Tuple
+
+from pyrogram import Client, raw, utils
+from pyrogram.handlers import RawUpdateHandler
+
+from config import GROUP_CALL_TTL, GROUP_CALL_NEGATIVE_TTL
+from metrics import CACHE_REQUESTS
+
+logger = logging.getLogger("groupcalls")
+
+# Handler group for the raw update listener, apart from py-tgcalls' own
+UPDATE_HANDLER_GROUP = 7
+
+def _is_joinable(call) -> bool:
+    """Check if a group call is running; a scheduled one can't be joined until it starts."""
+    return isinstance(call, raw.types.GroupCall) and call.schedule_date is None
+
+class GroupCallTracker:
+    """Whether each chat has a voice chat running, so /play can fail fast without one.
+
+    Answers come from the user account's view of the chat and are cached; voice
+    chat started/ended updates and the outcome of joins keep them current, so
+    the TTLs only matter if an update is missed. A chat without a voice chat is
+    rechecked sooner, as one is usually started right after a failed /play.
+    """
+
+    def __init__(self, ttl: float = GROUP_CALL_TTL, negative_ttl: float = GROUP_CALL_NEGATIVE_TTL):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.client: Optional[Client] = None
+        # chat id -> (voice chat running, time the answer expires)
+        self.states: Dict[int, Tuple[bool, float]] = {}
+        self._checking: Dict[int, asyncio.Future] = {}
+
+    def attach(self, client: Client):
+        """Check chats as ``client`` and follow its voice chat updates."""
+        self.client = client
+        client.add_handler(RawUpdateHandler(self._on_raw_update), group=UPDATE_HANDLER_GROUP)
+
+    def set(self, chat_id: int, active: bool):
+        """Record a voice chat's state learned from an update or a join attempt."""
+        self.states[chat_id] = (active, time.monotonic() + (self.ttl if active else self.negative_ttl))
+
+    def get(self, chat_id: int) -> Optional[bool]:
+        """Return the cached state for a chat, or None if unknown or expired."""
+        state = self.states.get(chat_id)
+        if state is None or state[1] <= time.monotonic():
+            return None
+        return state[0]
+
+    async def is_active(self, chat_id: int) -> Optional[bool]:
+        """Check whether a chat has a voice chat running; None if it couldn't be told."""
+        if self.ttl <= 0 or self.client is None:
+            return None
+
+        active = self.get(chat_id)
+        if active is not None:
+            CACHE_REQUESTS.inc(cache="group_call", result="hit")
+            return active
+
+        future = self._checking.get(chat_id)
+        if future is None:
+            CACHE_REQUESTS.inc(cache="group_call", result="miss")
+            future = asyncio.ensure_future(self._fetch(chat_id))
+            self._checking[chat_id] = future
+            future.add_done_callback(lambda _: self._checking.pop(chat_id, None))
+        else:
+            CACHE_REQUESTS.inc(cache="group_call", result="coalesced")
+
+        return await asyncio.shield(future)
+
+    async def _fetch(self, chat_id: int) -> Optional[bool]:
+        try:
+            peer = await self.client.resolve_peer(chat_id)
+            if isinstance(peer, raw.types.InputPeerChannel):
+                full = await self.client.invoke(raw.functions.channels.GetFullChannel(
+                    channel=raw.types.InputChannel(channel_id=peer.channel_id, access_hash=peer.access_hash)
+                ))
+            elif isinstance(peer, raw.types.InputPeerChat):
+                full = await self.client.invoke(raw.functions.messages.GetFullChat(chat_id=peer.chat_id))
+            else:
+                return None
+
+            # The full chat only references the call; its schedule comes with the call itself
+            call = full.full_chat.call
+            if call is not None:
+                call = (await self.client.invoke(raw.functions.phone.GetGroupCall(call=call, limit=1))).call
+        except Exception as e:
+            # The join itself will tell; don't turn a lookup error into a refusal
+            logger.warning(f"Error checking for a voice chat in {chat_id}: {e}")
+            return None
+
+        active = _is_joinable(call)
+        self.set(chat_id, active)
+        return active
+
+    async def _on_raw_update(self, client: Client, update, users, chats):
+        if not isinstance(update, raw.types.UpdateGroupCall) or update.chat_id is None:
+            return
+
+        if isinstance(chats.get(update.chat_id), raw.types.Channel):
+            chat_id = utils.get_channel_id(update.chat_id)
+        else:
+            chat_id = -update.chat_id
+
+        active = _is_joinable(update.call)
+        if self.get(chat_id) != active:
+            logger.info(f"Voice chat in {chat_id} {'started' if active else 'ended'}")
+        self.set(chat_id, active)
+
+# Create global group call tracker instance
+group_calls = GroupCallTracker()
@@ -2,7 +2,7 @@
 import time
 import asyncio
 import logging
-from typing import Dict, Optional, List
+from typing import Dict, Optional, List, Tuple
 from pyrogram import Client, filters
 from pyrogram.types import (
     Message, 
@@ -17,12 +17,21 @@ from pyrogram.errors import (
     PeerIdInvalid
 )
 
-import youtube
+import sources
+import filecache
+from filecache import file_cache
 from queues import music_queue
-from config import MESSAGES, DURATION_LIMIT, DEFAULT_VOLUME
+from sources import registry
+from config import MESSAGES, DEFAULT_VOLUME, ADMIN_IDS
+from metrics import TIME_TO_FIRST_AUDIO
+import tracing
+from tracing import span, traced_handler
+from lifecycle import lifecycle
+from admission import admission
+from autoplay import autoplay
+from effects import audio_effects
+from groupcalls import group_calls
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("handlers")
 
 # Store references to clients
@@ -48,6 +57,29 @@ async def is_user_in_call(chat_id: int, user_id: int) -> bool:
     except Exception:
         return False
 
+def source_rows(url: str) -> List[List[InlineKeyboardButton]]:
+    """Keyboard row linking to where a song came from, if it has a web page."""
+    if not url.startswith(("http://", "https://")):
+        return []
+    return [[InlineKeyboardButton(registry.label(url), url=url)]]
+
+def parse_position(text: str) -> Optional[int]:
+    """Convert a 1-based queue position as shown in /queue to a queue index."""
+    try:
+        position = int(text)
+    except ValueError:
+        return None
+    return position - 1 if position >= 1 else None
+
+def parse_range(text: str) -> Optional[Tuple[int, int]]:
+    """Parse a queue position or an ``a-b`` range into a pair of queue indexes."""
+    start_text, _, end_text = text.partition("-")
+    start = parse_position(start_text)
+    end = parse_position(end_text) if end_text else start
+    if start is None or end is None or end < start:
+        return None
+    return start, end
+
 def get_readable_time(seconds: int) -> str:
     """Convert seconds to readable time format."""
     minutes, seconds = divmod(seconds, 60)
@@ -101,8 +133,12 @@ def setup_handlers(bot: Client, user: Client, player):
     
     # Play commands
     @bot.on_message(filters.command(["play", "p"]))
+    @lifecycle.tracked
+    @admission.guarded
+    @traced_handler("play")
     async def play_command(client: Client, message: Message):
         """Handle /play command."""
+        received_at = time.perf_counter()
         chat_id = message.chat.id
         user_id = message.from_user.id
         
@@ -113,52 +149,81 @@ def setup_handlers(bot: Client, user: Client, player):
             )
             return
         
-        # Get query from message
+        # Get query from message, or the audio file it replies to
+        media = filecache.get_media(message.reply_to_message) if message.reply_to_message else None
         if message.reply_to_message and message.reply_to_message.text:
             query = message.reply_to_message.text
         else:
             query = " ".join(message.command[1:])
         
+        if not query and media is None:
+            await message.reply_text(
+                "Please provide a song name or YouTube link after the command!"
+            )
+            return
+        
+        # Without a voice chat to join, fail before any extraction work
+        in_call = music_player.is_in_call(chat_id)
+        if not in_call and await group_calls.is_active(chat_id) is False:
+            await message.reply_text(MESSAGES["no_voice_chat"])
+            return
+        
         # Send processing message
         processing_msg = await message.reply_text(MESSAGES["processing"])
         
+        # Join the voice chat while the song resolves, so the two waits overlap
+        prejoin = None
+        if music_player.prejoin_enabled and not in_call:
+            prejoin = asyncio.create_task(music_player.prejoin(chat_id))
+        
         try:
-            # Search for song
-            await processing_msg.edit_text(MESSAGES["extracting_info"])
-            search_results = await youtube.search_youtube(query, limit=1)
-            
-            if not search_results:
-                await processing_msg.edit_text(
-                    MESSAGES["no_results"].format(query=query)
-                )
-                return
-            
-            # Get first result
-            song_info = search_results[0]
+            if media is not None:
+                # Telegram upload: the message has everything but the file itself
+                song_info = filecache.media_info(message.reply_to_message, media)
+            elif registry.for_url(query):
+                # Links need one full extraction anyway; check cached metadata before it
+                song_info = registry.get_cached_metadata(query) or {"webpage_url": query}
+            else:
+                # Flat search: the duration and live status come with the results page
+                await processing_msg.edit_text(MESSAGES["extracting_info"])
+                search_results = await registry.search(query, limit=1, strict=True)
+                
+                if not search_results:
+                    await processing_msg.edit_text(
+                        MESSAGES["no_results"].format(query=query)
+                    )
+                    return
+                
+                # Get first result
+                song_info = search_results[0]
             
-            # Check duration limit
-            duration = song_info.get("duration", 0)
-            if duration > DURATION_LIMIT * 60:
-                await processing_msg.edit_text(
-                    f"❌ **Songs longer than {DURATION_LIMIT} minutes are not allowed!**\n"
-                    f"**Requested song duration:** {youtube.format_duration(duration)}"
-                )
+            # Check duration limit, live status and age restriction before extracting
+            reason = sources.check_entry(song_info)
+            if reason:
+                await processing_msg.edit_text(sources.rejection_message(reason, song_info))
                 return
             
             # Get audio URL
-            video_url = song_info.get("webpage_url", "") or f"https://www.youtube.com/watch?v={song_info.get('id', '')}"
+            video_url = song_info.get("webpage_url", "")
             await processing_msg.edit_text(MESSAGES["downloading"])
-            info, audio_url = await youtube.get_audio_url(video_url)
+            if media is not None:
+                info, audio_url = await file_cache.fetch(client, media)
+            else:
+                info, audio_url = await registry.resolve(video_url, live=sources.is_live(song_info))
             
-            if not audio_url:
+            if not info:
                 await processing_msg.edit_text(
-                    f"❌ **Failed to extract audio URL!**\n{info}"
+                    f"❌ **Failed to extract audio URL!**\n{audio_url}"
                 )
                 return
             
             # Format song info
+            song_info = {**song_info, **info}
+            video_url = song_info.get("webpage_url") or video_url
+            duration = song_info.get("duration") or 0
             title = song_info.get("title", "Unknown Title")
-            duration_str = youtube.format_duration(duration)
+            is_live = sources.is_live(song_info)
+            duration_str = "🔴 Live" if is_live else sources.format_duration(duration)
             thumbnail = song_info.get("thumbnail", "")
             
             # Enhanced song info
@@ -169,22 +234,40 @@ def setup_handlers(bot: Client, user: Client, player):
                 "thumbnail": thumbnail,
                 "webpage_url": video_url,
                 "audio_url": audio_url,
+                "is_live": is_live,
+                "protocol": song_info.get("protocol"),
+                "id": song_info.get("id"),
+                "source": song_info.get("source"),
                 "requested_by": user_id
             }
             
             # Add to queue
             current_queue = music_queue.get_queue(chat_id)
-            position = 0
             
-            # Check if queue is empty and bot is not currently playing
-            if not current_queue or not music_player.is_playing(chat_id):
-                # Add to queue
-                position = music_queue.add_to_queue(chat_id, formatted_song, user_id)
-                
-                # Play immediately since queue was empty or not playing
-                success = await music_player.play(chat_id, audio_url, formatted_song)
+            # Play now only if nothing is streaming; a paused song stays current
+            play_now = not current_queue or not music_player.is_in_call(chat_id)
+            
+            # The queue head is always the song the call is playing
+            with span("queue.add"):
+                position = music_queue.add_to_queue(chat_id, formatted_song, user_id, front=play_now)
+                queued_song = music_queue.get_queue(chat_id)[position] if position >= 0 else None
+            
+            if position == -1:
+                await processing_msg.edit_text(
+                    f"❌ **Queue limit reached!** ({music_queue.max_size} songs)"
+                )
+            elif position == -2:
+                await processing_msg.edit_text(
+                    MESSAGES["user_quota"].format(limit=music_queue.max_per_user)
+                )
+            elif play_now:
+                # Play immediately since nothing was streaming
+                with span("player.play"):
+                    success = await music_player.play(chat_id, audio_url, formatted_song)
                 
                 if success:
+                    TIME_TO_FIRST_AUDIO.observe(time.perf_counter() - received_at)
+                    
                     # Create inline keyboard
                     keyboard = InlineKeyboardMarkup([
                         [
@@ -192,7 +275,7 @@ def setup_handlers(bot: Client, user: Client, player):
                             InlineKeyboardButton("⏹ Stop", callback_data="stop"),
                             InlineKeyboardButton("⏭ Skip", callback_data="skip")
                         ],
-                        [InlineKeyboardButton("🎵 YouTube", url=video_url)]
+                        *source_rows(video_url)
                     ])
                     
                     # Send now playing message
@@ -210,40 +293,42 @@ def setup_handlers(bot: Client, user: Client, player):
                         "❌ **Failed to join voice chat!**\n"
                         "Make sure a voice chat is active in this group."
                     )
-                    music_queue.clear_queue(chat_id)
+                    # Other requesters' songs stay queued
+                    music_queue.remove_item(chat_id, queued_song)
             else:
-                # Add to queue since we're already playing something
-                position = music_queue.add_to_queue(chat_id, formatted_song, user_id)
+                # Create inline keyboard
+                rows = source_rows(video_url)
+                keyboard = InlineKeyboardMarkup(rows) if rows else None
                 
-                if position == -1:
-                    await processing_msg.edit_text(
-                        f"❌ **Queue limit reached!** ({music_queue.max_size} songs)"
-                    )
-                else:
-                    # Create inline keyboard
-                    keyboard = InlineKeyboardMarkup([
-                        [InlineKeyboardButton("🎵 YouTube", url=video_url)]
-                    ])
-                    
-                    # Send queued message
-                    await processing_msg.edit_text(
-                        MESSAGES["queued"].format(
-                            title=title,
-                            duration=duration_str,
-                            requester=f"[{message.from_user.first_name}](tg://user?id={user_id})",
-                            position=position + 1
-                        ),
-                        reply_markup=keyboard,
-                        disable_web_page_preview=False
-                    )
+                # Send queued message
+                await processing_msg.edit_text(
+                    MESSAGES["queued"].format(
+                        title=title,
+                        duration=duration_str,
+                        requester=f"[{message.from_user.first_name}](tg://user?id={user_id})",
+                        position=position + 1
+                    ),
+                    reply_markup=keyboard,
+                    disable_web_page_preview=False
+                )
         
         except Exception as e:
             logger.error(f"Error in play command: {e}")
             await processing_msg.edit_text(
                 MESSAGES["error"].format(error=str(e))
             )
+        
+        finally:
+            if prejoin is not None:
+                # Let the prejoin reach the actor first, or the release would miss it
+                joined, = await asyncio.gather(prejoin, return_exceptions=True)
+                if joined is True:
+                    await music_player.release_prejoin(chat_id)
     
     @bot.on_message(filters.command("search"))
+    @lifecycle.tracked
+    @admission.guarded
+    @traced_handler("search")
     async def search_command(client: Client, message: Message):
         """Handle /search command."""
         # Check if query was provided
@@ -261,7 +346,7 @@ def setup_handlers(bot: Client, user: Client, player):
         
         try:
             # Search for songs
-            search_results = await youtube.search_youtube(query, limit=5)
+            search_results = await registry.search(query, limit=5)
             
             if not search_results:
                 await processing_msg.edit_text(
@@ -276,14 +361,18 @@ def setup_handlers(bot: Client, user: Client, player):
             for i, result in enumerate(search_results, start=1):
                 title = result.get("title", "Unknown Title")
                 duration = result.get("duration", 0)
-                duration_str = youtube.format_duration(duration)
+                duration_str = sources.format_duration(duration)
                 video_id = result.get("id", "")
                 
                 text += f"**{i}.** {title}\n⏱ {duration_str}\n\n"
+                callback_data = f"play_{result['source']}:{video_id}"
+                if len(callback_data.encode()) > 64:
+                    # Telegram caps callback data at 64 bytes
+                    continue
                 buttons.append([
                     InlineKeyboardButton(
                         f"{i}. {title[:30]}...",
-                        callback_data=f"play_{video_id}"
+                        callback_data=callback_data
                     )
                 ])
             
@@ -320,9 +409,10 @@ def setup_handlers(bot: Client, user: Client, player):
             title = song.get("title", "Unknown Title")
             duration = song.get("duration_str", "Unknown Duration")
             requested_by = song.get("requested_by", 0)
+            requester = "📻 Autoplay" if song.get("autoplay") else f"<a href='tg://user?id={requested_by}'>User</a>"
             
             status = "🎵 Playing" if i == 0 else f"#{i+1} In Queue"
-            queue_text += f"**{status}:** {title}\n⏱ {duration} • Requested by: <a href='tg://user?id={requested_by}'>User</a>\n\n"
+            queue_text += f"**{status}:** {title}\n⏱ {duration} • Requested by: {requester}\n\n"
             
             # Limit message length
             if len(queue_text) > 3900:
@@ -366,14 +456,105 @@ def setup_handlers(bot: Client, user: Client, player):
             await message.reply_text(MESSAGES["not_in_call"])
             return
         
-        # Skip current song
-        success = await music_player.skip(chat_id)
+        # Get number of songs to skip
+        count = 1
+        if len(message.command) > 1:
+            try:
+                count = int(message.command[1])
+                if count < 1:
+                    raise ValueError
+            except ValueError:
+                await message.reply_text("Please provide a positive number of songs to skip!")
+                return
+        
+        # Skip all of them with a single stream switch
+        success = await music_player.skip(chat_id, count)
         
         if success:
-            await message.reply_text(MESSAGES["song_skipped"])
+            if count > 1:
+                await message.reply_text(MESSAGES["songs_skipped"].format(count=count))
+            else:
+                await message.reply_text(MESSAGES["song_skipped"])
         else:
             await message.reply_text("❌ **Failed to skip song!**")
     
+    @bot.on_message(filters.command("jump"))
+    async def jump_command(client: Client, message: Message):
+        """Handle /jump command."""
+        chat_id = message.chat.id
+        
+        # Check if bot is in call
+        if not music_player.is_in_call(chat_id):
+            await message.reply_text(MESSAGES["not_in_call"])
+            return
+        
+        if len(message.command) != 2:
+            await message.reply_text("Please provide the queue position to jump to, e.g. /jump 3")
+            return
+        
+        position = parse_position(message.command[1])
+        if position is None:
+            await message.reply_text(MESSAGES["invalid_position"])
+            return
+        
+        song = await music_player.jump(chat_id, position)
+        
+        if song:
+            await message.reply_text(MESSAGES["jumped"].format(title=song.get("title", "Unknown Title")))
+        else:
+            await message.reply_text(MESSAGES["invalid_position"])
+    
+    @bot.on_message(filters.command("remove"))
+    async def remove_command(client: Client, message: Message):
+        """Handle /remove command."""
+        chat_id = message.chat.id
+        
+        positions = parse_range(message.command[1]) if len(message.command) == 2 else None
+        if not positions:
+            await message.reply_text("Please provide a queue position or range to remove, e.g. /remove 3 or /remove 2-5")
+            return
+        
+        removed = await music_player.remove(chat_id, *positions)
+        
+        if removed:
+            await message.reply_text(MESSAGES["removed"].format(count=removed))
+        else:
+            await message.reply_text(MESSAGES["invalid_position"])
+    
+    @bot.on_message(filters.command("move"))
+    async def move_command(client: Client, message: Message):
+        """Handle /move command."""
+        chat_id = message.chat.id
+        
+        if len(message.command) != 3:
+            await message.reply_text("Please provide the old and new queue positions, e.g. /move 5 2")
+            return
+        
+        old_pos = parse_position(message.command[1])
+        new_pos = parse_position(message.command[2])
+        if old_pos is None or new_pos is None:
+            await message.reply_text(MESSAGES["invalid_position"])
+            return
+        
+        success = await music_player.move(chat_id, old_pos, new_pos)
+        
+        if success:
+            await message.reply_text(MESSAGES["moved"].format(old=old_pos + 1, new=new_pos + 1))
+        else:
+            await message.reply_text(MESSAGES["invalid_position"])
+    
+    @bot.on_message(filters.command("shuffle"))
+    async def shuffle_command(client: Client, message: Message):
+        """Handle /shuffle command."""
+        chat_id = message.chat.id
+        
+        success = await music_player.shuffle(chat_id)
+        
+        if success:
+            await message.reply_text(MESSAGES["shuffled"])
+        else:
+            await message.reply_text("❌ **Not enough songs in queue to shuffle!**")
+    
     @bot.on_message(filters.command("clear"))
     async def clear_command(client: Client, message: Message):
         """Handle /clear command."""
@@ -480,6 +661,113 @@ def setup_handlers(bot: Client, user: Client, player):
         else:
             await message.reply_text("❌ **Failed to set volume!**")
     
+    @bot.on_message(filters.command("autoplay"))
+    async def autoplay_command(client: Client, message: Message):
+        """Handle /autoplay command."""
+        chat_id = message.chat.id
+        
+        # Toggle unless told which way
+        argument = message.command[1].lower() if len(message.command) > 1 else ""
+        if argument not in ("", "on", "off"):
+            await message.reply_text("Usage: /autoplay [on|off]")
+            return
+        enabled = argument == "on" if argument else not autoplay.is_enabled(chat_id)
+        
+        autoplay.set_enabled(chat_id, enabled)
+        if enabled and music_player.is_in_call(chat_id) and not music_queue.has_next(chat_id):
+            autoplay.prefetch(chat_id)
+        await message.reply_text(MESSAGES["autoplay_on" if enabled else "autoplay_off"])
+    
+    # Argument parsers and usage of the effect commands
+    EFFECT_COMMANDS = {
+        "speed": (float, "/speed [0.5-2.0]"),
+        "pitch": (int, "/pitch [-12-12]"),
+        "bass": (int, "/bass [0-20]"),
+    }
+    
+    async def update_effects(message: Message, **changes):
+        """Change a chat's effects and restart the current song with them."""
+        chat_id = message.chat.id
+        effects = audio_effects.update(chat_id, **changes)
+        if music_player.is_in_call(chat_id) and not await music_player.apply_effects(chat_id):
+            await message.reply_text("❌ **Failed to apply effects!**")
+            return
+        await message.reply_text(MESSAGES["effects_set"].format(effects=effects.describe()))
+    
+    @bot.on_message(filters.command(list(EFFECT_COMMANDS)))
+    async def effect_command(client: Client, message: Message):
+        """Handle /speed, /pitch and /bass commands."""
+        name = message.command[0].lower()
+        parse, usage = EFFECT_COMMANDS[name]
+        
+        # Without a value, show the current one
+        if len(message.command) != 2:
+            effects = audio_effects.get(message.chat.id)
+            await message.reply_text(MESSAGES["effects"].format(effects=effects.describe()) + f"\n**Usage:** {usage}")
+            return
+        
+        try:
+            value = parse(message.command[1])
+        except ValueError:
+            await message.reply_text(MESSAGES["invalid_effect"].format(error=f"Invalid {name} value!", usage=usage))
+            return
+        
+        try:
+            await update_effects(message, **{name: value})
+        except ValueError as e:
+            await message.reply_text(MESSAGES["invalid_effect"].format(error=str(e), usage=usage))
+    
+    @bot.on_message(filters.command("normalize"))
+    async def normalize_command(client: Client, message: Message):
+        """Handle /normalize command."""
+        # Toggle unless told which way
+        argument = message.command[1].lower() if len(message.command) > 1 else ""
+        if argument not in ("", "on", "off"):
+            await message.reply_text("Usage: /normalize [on|off]")
+            return
+        enabled = argument == "on" if argument else not audio_effects.get(message.chat.id).normalize
+        await update_effects(message, normalize=enabled)
+    
+    @bot.on_message(filters.command("effects"))
+    async def effects_command(client: Client, message: Message):
+        """Handle /effects command."""
+        chat_id = message.chat.id
+        if len(message.command) > 1 and message.command[1].lower() == "reset":
+            audio_effects.reset(chat_id)
+            if music_player.is_in_call(chat_id):
+                await music_player.apply_effects(chat_id)
+            await message.reply_text(MESSAGES["effects_reset"])
+            return
+        
+        await message.reply_text(MESSAGES["effects"].format(effects=audio_effects.get(chat_id).describe()))
+    
+    # Admin commands
+    @bot.on_message(filters.command("debug"))
+    async def debug_command(client: Client, message: Message):
+        """Handle /debug command."""
+        if not message.from_user or message.from_user.id not in ADMIN_IDS:
+            await message.reply_text(MESSAGES["admin_only"])
+            return
+        
+        if len(message.command) < 2 or message.command[1] != "last":
+            await message.reply_text("Usage: /debug last [count]")
+            return
+        
+        # Get number of traces to show
+        try:
+            limit = int(message.command[2]) if len(message.command) > 2 else 5
+        except ValueError:
+            limit = 5
+        
+        traces = tracing.slowest(max(1, min(limit, 20)))
+        if not traces:
+            await message.reply_text(MESSAGES["no_traces"])
+            return
+        
+        text = "🐢 **Slowest recent requests:**\n\n"
+        text += "\n\n".join(tracing.format_trace(trace) for trace in traces)
+        await message.reply_text(text[:4000], disable_web_page_preview=True)
+    
     # Callback handlers
     @bot.on_callback_query()
     async def callback_handler(client: Client, query: CallbackQuery):
@@ -526,11 +814,17 @@ def setup_handlers(bot: Client, user: Client, player):
                 await query.answer("Queue is already empty!", show_alert=True)
         
         elif data.startswith("play_"):
-            # Extract video ID
-            video_id = data.split("_")[1]
+            # Extract source and ID; buttons sent before sources existed only have a YouTube ID
+            source_name, separator, video_id = data[len("play_"):].partition(":")
+            if not separator:
+                source_name, video_id = "youtube", source_name
+            source = registry.get(source_name)
+            if source is None:
+                await query.answer("Unknown command!")
+                return
             
             # Get video URL
-            video_url = f"https://www.youtube.com/watch?v={video_id}"
+            video_url = source.url_for_id(video_id)
             
             # Reply to the original search message
             await query.message.reply_text(f"/play {video_url}")
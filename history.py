@@ -0,0 +1,146 @@
+import heapq
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import HISTORY_PATH, HISTORY_MAX_LINES, POPULARITY_HALF_LIFE, POPULARITY_MAX_TRACKS
+
+logger = logging.getLogger("history")
+
+# Even a skipped song was asked for, so it counts for something
+MIN_PLAY_WEIGHT = 0.1
+
+# Tracks remembered per chat for its own "popular" list
+CHAT_MAX_TRACKS = 200
+
+def track_key(song_info: Dict[str, Any]) -> Optional[str]:
+    """Identify a song across plays: its link, or ``telegram:<file_unique_id>`` for uploads."""
+    if song_info.get("source") == "telegram":
+        return f"telegram:{song_info['id']}" if song_info.get("id") else None
+    url = song_info.get("webpage_url")
+    return url if url and " " not in url else None
+
+class PlayHistory:
+    """Append-only log of finished plays, and time-decayed popularity built from it.
+
+    Each line is ``<unix time> <chat id> <completion ratio> <track>``. A play
+    adds its completion ratio to the track's score, and scores halve every
+    ``half_life`` seconds, so recent favourites rank above old ones.
+    """
+
+    def __init__(
+        self,
+        path: str = HISTORY_PATH,
+        half_life: float = POPULARITY_HALF_LIFE,
+        max_tracks: int = POPULARITY_MAX_TRACKS
+    ):
+        self.path = path
+        self.half_life = half_life
+        self.max_tracks = max_tracks
+        # track -> (score, time the score was last updated)
+        self.scores: Dict[str, Tuple[float, float]] = {}
+        self.chat_scores: Dict[int, Dict[str, Tuple[float, float]]] = {}
+        self._pending: List[str] = []
+
+    def _decay(self, seconds: float) -> float:
+        return 0.5 ** (seconds / self.half_life) if self.half_life > 0 else 1.0
+
+    def _bump(self, scores: Dict[str, Tuple[float, float]], track: str, weight: float, at: float, limit: int):
+        score, updated = scores.get(track, (0.0, at))
+        if at >= updated:
+            scores[track] = (score * self._decay(at - updated) + weight, at)
+        else:
+            # Replaying an older line: decay the new weight instead
+            scores[track] = (score + weight * self._decay(updated - at), updated)
+
+        # Let the map overshoot a little so pruning isn't done on every play
+        if len(scores) > limit * 1.1:
+            self._prune(scores, limit, at)
+
+    def _prune(self, scores: Dict[str, Tuple[float, float]], limit: int, now: float):
+        keep = heapq.nlargest(limit, scores, key=lambda track: self._score(scores[track], now))
+        for track in set(scores) - set(keep):
+            del scores[track]
+
+    def _score(self, entry: Tuple[float, float], now: float) -> float:
+        score, updated = entry
+        return score * self._decay(now - updated)
+
+    def _apply(self, chat_id: int, track: str, ratio: float, at: float):
+        weight = max(ratio, MIN_PLAY_WEIGHT)
+        self._bump(self.scores, track, weight, at, self.max_tracks)
+        self._bump(self.chat_scores.setdefault(chat_id, {}), track, weight, at, CHAT_MAX_TRACKS)
+
+    def record(self, chat_id: int, song_info: Dict[str, Any], elapsed: float, at: Optional[float] = None):
+        """Log a song that stopped playing after ``elapsed`` seconds."""
+        track = track_key(song_info)
+        if track is None:
+            return
+
+        duration = song_info.get("duration") or 0
+        ratio = min(1.0, max(0.0, elapsed / duration)) if duration and not song_info.get("is_live") else 1.0
+        at = at if at is not None else time.time()
+        self._apply(chat_id, track, ratio, at)
+        if self.path:
+            self._pending.append(f"{at:.0f} {chat_id} {ratio:.2f} {track}\n")
+
+    def top(self, count: int, chat_id: Optional[int] = None) -> List[Tuple[str, float]]:
+        """Return the ``count`` most popular tracks with their current scores, overall or in a chat."""
+        scores = self.scores if chat_id is None else self.chat_scores.get(chat_id, {})
+        now = time.time()
+        return heapq.nlargest(
+            count,
+            ((track, self._score(entry, now)) for track, entry in scores.items()),
+            key=lambda item: item[1]
+        )
+
+    def load(self) -> int:
+        """Rebuild the scores from the log and return how many plays were read.
+
+        Blocking; run it off the event loop. A log longer than ``HISTORY_MAX_LINES``
+        is cut down to its most recent lines.
+        """
+        if not self.path or not os.path.exists(self.path):
+            return 0
+
+        with open(self.path) as f:
+            lines = f.readlines()
+
+        if HISTORY_MAX_LINES and len(lines) > HISTORY_MAX_LINES:
+            lines = lines[-HISTORY_MAX_LINES:]
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                f.writelines(lines)
+            os.replace(tmp_path, self.path)
+
+        loaded = 0
+        for line in lines:
+            try:
+                at, chat_id, ratio, track = line.rstrip("\n").split(" ", 3)
+                self._apply(int(chat_id), track, float(ratio), float(at))
+                loaded += 1
+            except ValueError:
+                logger.warning(f"Skipping malformed history line: {line!r}")
+        return loaded
+
+    def flush(self) -> int:
+        """Append plays recorded since the last flush and return how many were written.
+
+        Blocking; run it off the event loop.
+        """
+        if not self._pending:
+            return 0
+
+        pending, self._pending = self._pending, []
+        try:
+            with open(self.path, "a") as f:
+                f.writelines(pending)
+        except OSError as e:
+            logger.error(f"Error writing play history: {e}")
+            self._pending = pending + self._pending
+            return 0
+        return len(pending)
+
+# Create global play history instance
+play_history = PlayHistory()
@@ -0,0 +1,109 @@
+import asyncio
+import functools
+import logging
+import signal
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+from config import SHUTDOWN_TIMEOUT, SHUTDOWN_DRAIN_TIMEOUT, MESSAGES
+
+logger = logging.getLogger("lifecycle")
+
+class Lifecycle:
+    """Tracks in-flight requests and coordinates a graceful shutdown.
+
+    Draining and the shutdown steps share one ``shutdown_timeout`` budget,
+    counted from the shutdown request, so the process exits before the
+    platform kills it.
+    """
+
+    def __init__(self, drain_timeout: float = SHUTDOWN_DRAIN_TIMEOUT, shutdown_timeout: float = SHUTDOWN_TIMEOUT):
+        self.drain_timeout = drain_timeout
+        self.shutdown_timeout = shutdown_timeout
+        self.accepting = True
+        self._deadline: Optional[float] = None
+        self._in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._shutdown = asyncio.Event()
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def install_signal_handlers(self):
+        """Turn SIGTERM and SIGINT into a graceful shutdown request."""
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, self.request_shutdown, sig.name)
+            except (NotImplementedError, RuntimeError):
+                # Not supported on this platform, fall back to KeyboardInterrupt
+                pass
+
+    def request_shutdown(self, reason: str = "requested"):
+        """Stop accepting new work and wake up ``wait_for_shutdown``."""
+        if not self._shutdown.is_set():
+            logger.info(f"Shutdown requested ({reason}).")
+        if self._deadline is None:
+            self._deadline = asyncio.get_running_loop().time() + self.shutdown_timeout
+        self.accepting = False
+        self._shutdown.set()
+
+    async def wait_for_shutdown(self):
+        await self._shutdown.wait()
+
+    def remaining(self) -> float:
+        """Seconds left of the shutdown budget."""
+        if self._deadline is None:
+            return self.shutdown_timeout
+        return max(0.0, self._deadline - asyncio.get_running_loop().time())
+
+    @asynccontextmanager
+    async def track(self):
+        """Count the enclosed block as in-flight work."""
+        self._in_flight += 1
+        self._idle.clear()
+        try:
+            yield
+        finally:
+            self._in_flight -= 1
+            if self._in_flight == 0:
+                self._idle.set()
+
+    def tracked(self, func):
+        """Decorator for handlers that should be rejected while shutting down."""
+        @functools.wraps(func)
+        async def wrapper(client, message):
+            if not self.accepting:
+                await message.reply_text(MESSAGES["shutting_down"])
+                return
+            async with self.track():
+                return await func(client, message)
+        return wrapper
+
+    async def drain(self) -> bool:
+        """Wait for in-flight work to finish, up to the drain timeout."""
+        self.accepting = False
+        if self._in_flight:
+            logger.info(f"Waiting for {self._in_flight} in-flight requests...")
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=min(self.drain_timeout, self.remaining()))
+            return True
+        except asyncio.TimeoutError:
+            logger.warning(f"Gave up waiting for {self._in_flight} in-flight requests.")
+            return False
+
+    async def run_steps(self, steps: List[Tuple[str, Callable[[], Awaitable]]], timeout: float = 10):
+        """Run shutdown steps in order, logging and skipping past failures.
+
+        Each step gets up to ``timeout`` seconds, but no more than what is left of the budget.
+        """
+        for name, step in steps:
+            try:
+                await asyncio.wait_for(step(), timeout=min(timeout, self.remaining()))
+            except Exception as e:
+                logger.error(f"Error during shutdown step '{name}': {e}")
+
+# Create global lifecycle instance
+lifecycle = Lifecycle()
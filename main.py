@@ -1,23 +1,74 @@
 
 import os
+import time
 import asyncio
 import logging
+from contextlib import contextmanager
+from typing import List, Tuple
+
+# Configure logging before the rest of the bot is imported
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+_imports_started = time.perf_counter()
+
 from pyrogram import Client
 from pyrogram.errors import AuthKeyUnregistered, AuthKeyInvalid
 
-from config import API_ID, API_HASH, BOT_TOKEN, SESSION_STRING
+from config import API_ID, API_HASH, BOT_TOKEN, SESSION_STRING, QUEUE_SNAPSHOT_PATH, QUEUE_SNAPSHOT_MAX_AGE
 from stream import MusicPlayer
+from reaper import IdleReaper
+from warmer import CacheWarmer
+from queues import music_queue
+import metrics
+import tracing
+from monitor import LoopMonitor
+import youtube
+from sources import register_default_sources
+from filecache import file_cache
+from effects import audio_effects
+from groupcalls import group_calls
 import handlers
+from lifecycle import lifecycle
+
+IMPORT_TIME = time.perf_counter() - _imports_started
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-)
 logger = logging.getLogger("main")
 
+class StartupTimer:
+    """Record how long each startup phase takes."""
+    
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.phases: List[Tuple[str, float]] = [("imports", IMPORT_TIME)]
+    
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start))
+    
+    def report(self) -> str:
+        total = time.perf_counter() - self.started_at
+        phases = ", ".join(f"{name} {duration:.2f}s" for name, duration in self.phases)
+        return f"Startup finished in {total:.2f}s ({phases})"
+
+async def warm_up_ytdl():
+    """Load yt-dlp in the background and log how long it took."""
+    start = time.perf_counter()
+    try:
+        await youtube.warm_up()
+        logger.info(f"yt-dlp loaded in {time.perf_counter() - start:.2f}s")
+    except Exception as e:
+        logger.error(f"Error loading yt-dlp: {e}")
+
 async def main():
     """Main entry point for the bot."""
+    timer = StartupTimer()
+    
     # Initialize clients
     logger.info("Initializing clients...")
     
@@ -37,33 +88,71 @@ async def main():
         session_string=SESSION_STRING
     )
     
+    # Follow voice chats starting and ending so /play can check for one up front
+    group_calls.attach(user)
+    
     # Initialize PyTgCalls
     logger.info("Initializing PyTgCalls...")
     music_player = MusicPlayer(user)
+    reaper = IdleReaper(music_player)
+    warmer = CacheWarmer()
+    
+    # Set up metrics
+    metrics_server = metrics.MetricsServer()
+    loop_monitor = LoopMonitor()
+    metrics.instrument_client(bot, "bot")
+    metrics.instrument_client(user, "user")
+    tracing.instrument_client(bot)
+    metrics.ACTIVE_CALLS.set_function(lambda: len(music_player.active_streams))
+    metrics.QUEUED_TRACKS.set_function(
+        lambda: sum(len(queue) for queue in music_queue.queues.values())
+    )
+    metrics.LONGEST_QUEUE.set_function(
+        lambda: max((len(queue) for queue in music_queue.queues.values()), default=0)
+    )
+    
+    # Pick up the queues saved by the previous run's shutdown
+    try:
+        restored = music_queue.load_snapshot(QUEUE_SNAPSHOT_PATH, QUEUE_SNAPSHOT_MAX_AGE)
+        if restored:
+            logger.info(f"Restored {restored} queues from {QUEUE_SNAPSHOT_PATH}")
+    except (OSError, ValueError) as e:
+        logger.error(f"Error restoring queues: {e}")
+    
+    # Make YouTube, SoundCloud, links and local files playable
+    register_default_sources()
     
     # Set up command handlers
     logger.info("Setting up command handlers...")
     handlers.setup_handlers(bot, user, music_player)
     
+    # Load yt-dlp in the background while the clients connect
+    ytdl_warmup = asyncio.create_task(warm_up_ytdl())
+    
     # Start clients
     try:
-        logger.info("Starting bot client...")
-        await bot.start()
+        lifecycle.install_signal_handlers()
+        
+        logger.info("Starting bot and user clients...")
+        with timer.phase("clients"):
+            await asyncio.gather(bot.start(), user.start())
         
-        logger.info("Starting user client...")
-        await user.start()
+        logger.info("Starting PyTgCalls client and metrics endpoint...")
+        with timer.phase("pytgcalls"):
+            await asyncio.gather(music_player.start(), metrics_server.start())
         
-        logger.info("Starting PyTgCalls client...")
-        await music_player.start()
+        logger.info("Starting background tasks...")
+        reaper.start()
+        warmer.start()
+        loop_monitor.start()
         
         logger.info("Bot started successfully!")
-        me_bot = await bot.get_me()
-        me_user = await user.get_me()
-        logger.info(f"Bot username: @{me_bot.username}")
-        logger.info(f"User account: {me_user.first_name} (@{me_user.username})")
+        logger.info(timer.report())
+        logger.info(f"Bot username: @{bot.me.username}")
+        logger.info(f"User account: {user.me.first_name} (@{user.me.username})")
         
-        # Keep the program running
-        await asyncio.Event().wait()
+        # Keep the program running until SIGTERM/SIGINT
+        await lifecycle.wait_for_shutdown()
     
     except (AuthKeyUnregistered, AuthKeyInvalid):
         logger.error("Session string is invalid or expired! Please generate a new one.")
@@ -75,11 +164,34 @@ async def main():
         logger.error(f"Error starting bot: {e}")
     
     finally:
-        # Stop clients
-        logger.info("Stopping clients...")
-        await bot.stop()
-        await user.stop()
-        logger.info("Clients stopped.")
+        # Stop accepting new work and let in-flight requests finish
+        lifecycle.request_shutdown("exiting")
+        ytdl_warmup.cancel()
+        await lifecycle.drain()
+        
+        # Save queues and leave calls so no assistant is left in a voice chat
+        def save_queues():
+            saved = music_queue.save_snapshot(QUEUE_SNAPSHOT_PATH)
+            logger.info(f"Saved {saved} queues to {QUEUE_SNAPSHOT_PATH}")
+        
+        async def leave_calls():
+            left = await music_player.leave_all()
+            logger.info(f"Left {left} voice chats.")
+        
+        async def stop_clients():
+            logger.info("Stopping clients...")
+            await asyncio.gather(bot.stop(), user.stop(), return_exceptions=True)
+            logger.info("Clients stopped.")
+        
+        await lifecycle.run_steps([
+            ("save queues", lambda: asyncio.to_thread(save_queues)),
+            ("leave calls", leave_calls),
+            ("stop background tasks", lambda: asyncio.gather(
+                reaper.stop(), warmer.stop(), loop_monitor.stop(), metrics_server.stop(),
+                music_player.actors.stop(), audio_effects.stop(), file_cache.stop()
+            )),
+            ("stop clients", stop_clients),
+        ])
 
 if __name__ == "__main__":
     # Run the main function
@@ -0,0 +1,304 @@
+import asyncio
+import bisect
+import logging
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from config import METRICS_HOST, METRICS_PORT
+
+logger = logging.getLogger("metrics")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelValues = Tuple[str, ...]
+
+def _escape(value: str) -> str:
+    """Escape a label value for the text exposition format."""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    """Render a Prometheus label set."""
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class _Metric(ABC):
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+            *self._samples(),
+        ]
+
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        """Return the metric's sample lines."""
+
+class Counter(_Metric):
+    """Monotonically increasing counter."""
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+            for key, value in self.values.items()
+        ]
+
+class Gauge(_Metric):
+    """Value that can go up and down, or be computed on scrape."""
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.values: Dict[LabelValues, float] = {}
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, **labels):
+        self.values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], float]):
+        """Compute the (unlabelled) gauge value at scrape time."""
+        self._function = function
+
+    def _samples(self) -> List[str]:
+        if self._function is not None:
+            try:
+                return [f"{self.name} {float(self._function())}"]
+            except Exception as e:
+                logger.error(f"Error computing gauge {self.name}: {e}")
+                return []
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+            for key, value in self.values.items()
+        ]
+
+class Histogram(_Metric):
+    """Bucketed distribution of observed values."""
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.counts: Dict[LabelValues, List[int]] = {}
+        self.sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        counts = self.counts.setdefault(key, [0] * (len(self.buckets) + 1))
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sums[key] = self.sums.get(key, 0.0) + value
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """Observe the wall-clock duration of the enclosed block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for key, counts in self.counts.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            cumulative += counts[-1]
+            labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {self.sums[key]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+REGISTRY: List[_Metric] = []
+
+# Hot path metrics
+EXTRACTION_LATENCY = Histogram(
+    "musicbot_extraction_seconds",
+    "Time spent in yt-dlp extraction",
+    labelnames=("kind",)
+)
+CACHE_REQUESTS = Counter(
+    "musicbot_cache_requests_total",
+    "Cache lookups by cache and result",
+    labelnames=("cache", "result")
+)
+UPSTREAM_ERRORS = Counter(
+    "musicbot_upstream_errors_total",
+    "Failed yt-dlp requests by upstream and error class",
+    labelnames=("upstream", "kind")
+)
+UPSTREAM_CIRCUIT_OPEN = Gauge(
+    "musicbot_upstream_circuit_open",
+    "1 while requests to an upstream from a local address are paused",
+    labelnames=("upstream", "address")
+)
+UPSTREAM_RATE = Gauge("musicbot_upstream_rate_limit", "Current yt-dlp request rate limit per minute")
+CACHE_WARMS = Counter(
+    "musicbot_cache_warms_total",
+    "Popular tracks handled by the cache warmer by result",
+    labelnames=("result",)
+)
+EFFECTS_JOBS = Counter(
+    "musicbot_effects_jobs_total",
+    "Loudness analyses and effect renders by result",
+    labelnames=("job", "result")
+)
+TIME_TO_FIRST_AUDIO = Histogram(
+    "musicbot_time_to_first_audio_seconds",
+    "Time from a /play command to audio starting in the voice chat"
+)
+STREAM_TRANSITION = Histogram(
+    "musicbot_stream_transition_seconds",
+    "Time taken to switch the voice chat to the next track",
+    labelnames=("reason",)
+)
+ACTIVE_CALLS = Gauge("musicbot_active_calls", "Voice chats currently being streamed to")
+QUEUED_TRACKS = Gauge("musicbot_queued_tracks", "Tracks queued across all chats")
+LONGEST_QUEUE = Gauge("musicbot_longest_queue", "Length of the longest chat queue")
+TELEGRAM_API_CALLS = Counter(
+    "musicbot_telegram_api_calls_total",
+    "Outbound Telegram API calls",
+    labelnames=("client", "method")
+)
+FLOOD_WAITS = Counter(
+    "musicbot_flood_waits_total",
+    "FloodWait errors received from Telegram",
+    labelnames=("client", "handling")
+)
+ADMISSION_REJECTIONS = Counter(
+    "musicbot_admission_rejections_total",
+    "/play and /search requests turned away by admission control",
+    labelnames=("reason",)
+)
+PENDING_RESOLVES = Gauge("musicbot_pending_resolves", "Admitted /play and /search requests not yet finished")
+LOOP_LAG = Histogram(
+    "musicbot_event_loop_lag_seconds",
+    "Delay between a scheduled wakeup and the event loop running it",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+)
+SLOW_CALLBACKS = Counter(
+    "musicbot_slow_callbacks_total",
+    "Callbacks that blocked the event loop past the threshold",
+    labelnames=("handler",)
+)
+
+def record_cache(cache: str, hit: bool):
+    """Count a cache lookup."""
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+def render() -> str:
+    """Render all metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+def instrument_client(client, name: str):
+    """Count outbound API calls and FloodWaits for a Pyrogram client."""
+    from pyrogram.errors import FloodWait
+
+    invoke = client.invoke
+
+    async def instrumented_invoke(query, *args, **kwargs):
+        TELEGRAM_API_CALLS.inc(client=name, method=type(query).__name__)
+        try:
+            return await invoke(query, *args, **kwargs)
+        except FloodWait:
+            FLOOD_WAITS.inc(client=name, handling="raised")
+            raise
+
+    client.invoke = instrumented_invoke
+
+class _FloodWaitSleepHandler(logging.Handler):
+    """Count the FloodWaits that Pyrogram sleeps through internally."""
+
+    def emit(self, record: logging.LogRecord):
+        if "Waiting for" in record.getMessage():
+            FLOOD_WAITS.inc(client="session", handling="slept")
+
+logging.getLogger("pyrogram.session.session").addHandler(_FloodWaitSleepHandler())
+
+class MetricsServer:
+    """Minimal HTTP server exposing ``/metrics``."""
+
+    def __init__(self, host: str = METRICS_HOST, port: int = METRICS_PORT):
+        self.host = host
+        self.port = port
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        if self.port <= 0:
+            logger.info("Metrics endpoint disabled.")
+            return
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"Metrics endpoint listening on http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # Drain the request headers
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+                pass
+
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", render().encode()
+            else:
+                status, body = "404 Not Found", b"Not Found\n"
+
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except Exception as e:
+            logger.error(f"Error serving metrics: {e}")
+        finally:
+            writer.close()
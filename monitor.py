@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Optional
+
+from config import LOOP_LAG_INTERVAL, SLOW_CALLBACK_THRESHOLD, ASYNCIO_DEBUG
+from metrics import LOOP_LAG, SLOW_CALLBACKS
+
+logger = logging.getLogger("monitor")
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+class LoopMonitor:
+    """Samples event-loop lag and reports callbacks that block the loop.
+
+    A heartbeat task on the loop records how late each wakeup is. A watchdog
+    thread checks the heartbeat and, when it stalls past the threshold, logs
+    the stack of the loop thread so the blocking handler can be identified.
+    """
+
+    def __init__(
+        self,
+        interval: float = LOOP_LAG_INTERVAL,
+        threshold: float = SLOW_CALLBACK_THRESHOLD
+    ):
+        self.interval = interval
+        self.threshold = threshold
+        self._last_beat = time.monotonic()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        """Start the heartbeat task and the watchdog thread."""
+        if self.interval <= 0 or self._task is not None:
+            return
+
+        loop = asyncio.get_running_loop()
+        if ASYNCIO_DEBUG:
+            loop.set_debug(True)
+            loop.slow_callback_duration = self.threshold or loop.slow_callback_duration
+
+        self._loop = loop
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+
+        if self.threshold > 0:
+            self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+            self._watchdog.start()
+        logger.info(f"Loop monitor started (interval {self.interval}s, threshold {self.threshold}s).")
+
+    async def stop(self):
+        """Stop monitoring."""
+        self._stopped.set()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._watchdog:
+            self._watchdog.join(timeout=self.interval + 1)
+            self._watchdog = None
+
+    async def _heartbeat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            LOOP_LAG.observe(max(0.0, now - expected))
+            self._last_beat = now
+
+    def _watch(self):
+        stalled_beat = None
+        while not self._stopped.wait(min(self.interval, self.threshold) / 2):
+            last_beat = self._last_beat
+            blocked_for = time.monotonic() - last_beat - self.interval
+            if blocked_for > self.threshold and last_beat != stalled_beat:
+                # Report each stall once
+                stalled_beat = last_beat
+                self._report(blocked_for)
+
+    def _report(self, blocked_for: float):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return
+
+        stack = traceback.extract_stack(frame)
+        handler = "unknown"
+        for entry in reversed(stack):
+            if (
+                entry.filename.startswith(PROJECT_DIR)
+                and "site-packages" not in entry.filename
+                and entry.filename != os.path.abspath(__file__)
+            ):
+                handler = entry.name
+                break
+
+        # Metrics are only touched on the loop, which may be rendering them right now
+        self._loop.call_soon_threadsafe(lambda: SLOW_CALLBACKS.inc(handler=handler))
+        logger.warning(
+            f"Event loop blocked for {blocked_for * 1000:.0f}ms in {handler}\n"
+            + "".join(traceback.format_list(stack[-15:]))
+        )
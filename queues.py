@@ -1,17 +1,33 @@
 
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Set, Tuple, Iterable
+import bisect
+import itertools
+import json
+import os
+import random
 import time
 import asyncio
 import logging
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+from config import MAX_PLAYLIST_SIZE, FAIR_QUEUE, MAX_SONGS_PER_USER
+
 logger = logging.getLogger("queues")
 
+def _fair_key(item: Dict[str, Any]) -> Tuple[int, int]:
+    return item.get("fair_round", 0), item.get("fair_seq", 0)
+
 class MusicQueue:
-    def __init__(self, max_size: int = 50):
+    def __init__(self, max_size: int = 50, fair: bool = False, max_per_user: int = 0):
         self.queues: Dict[int, List[Dict[str, Any]]] = {}
         self.max_size = max_size
+        
+        # Fair-share mode interleaves requesters round-robin instead of strict FIFO
+        self.fair = fair
+        self.max_per_user = max_per_user
+        self._seq = itertools.count()
+        
+        # Per-chat totals kept up to date on every change instead of recomputed
+        self.stats: Dict[int, Dict[str, Any]] = {}
     
     def get_queue(self, chat_id: int) -> List[Dict[str, Any]]:
         """Get the queue for a chat."""
@@ -19,13 +35,54 @@ class MusicQueue:
             self.queues[chat_id] = []
         return self.queues[chat_id]
     
+    def _get_stats(self, chat_id: int) -> Dict[str, Any]:
+        if chat_id not in self.stats:
+            self.stats[chat_id] = {"total_duration": 0, "per_user": {}, "rounds": {}}
+        return self.stats[chat_id]
+    
+    def _track_added(self, chat_id: int, item: Dict[str, Any]):
+        stats = self._get_stats(chat_id)
+        stats["total_duration"] += item.get("duration") or 0
+        user = item.get("requested_by")
+        stats["per_user"][user] = stats["per_user"].get(user, 0) + 1
+    
+    def _track_removed(self, chat_id: int, items: Iterable[Dict[str, Any]]):
+        stats = self._get_stats(chat_id)
+        for item in items:
+            stats["total_duration"] -= item.get("duration") or 0
+            user = item.get("requested_by")
+            remaining = stats["per_user"].get(user, 0) - 1
+            if remaining > 0:
+                stats["per_user"][user] = remaining
+            else:
+                stats["per_user"].pop(user, None)
+                stats["rounds"].pop(user, None)
+    
+    def _recount_rounds(self, chat_id: int):
+        """Recompute each requester's latest fair-share round after removals."""
+        stats = self._get_stats(chat_id)
+        stats["rounds"] = {}
+        for item in self.get_queue(chat_id):
+            user = item.get("requested_by")
+            stats["rounds"][user] = max(stats["rounds"].get(user, 0), item.get("fair_round", 0))
+    
+    def _rekey(self, chat_id: int):
+        """Freeze a manually reordered queue as the new fair-share order."""
+        queue = self.get_queue(chat_id)
+        base = queue[0].get("fair_round", 0) if queue else 0
+        for item in queue:
+            item["fair_round"] = base
+            item["fair_seq"] = next(self._seq)
+        self._recount_rounds(chat_id)
+    
     def add_to_queue(
         self, 
         chat_id: int, 
         song_info: Dict[str, Any], 
-        requested_by: int
+        requested_by: int,
+        front: bool = False
     ) -> int:
-        """Add a song to the queue and return its position."""
+        """Add a song to the queue and return its position; ``front`` makes it the current song."""
         if chat_id not in self.queues:
             self.queues[chat_id] = []
         
@@ -34,38 +91,79 @@ class MusicQueue:
         if len(queue) >= self.max_size:
             return -1
         
+        # Check the requester's quota
+        stats = self._get_stats(chat_id)
+        if self.max_per_user and stats["per_user"].get(requested_by, 0) >= self.max_per_user:
+            return -2
+        
         # Add song to queue with metadata
         queue_item = {
             **song_info,
             "requested_by": requested_by,
             "queued_at": time.time()
         }
-        queue.append(queue_item)
+        
+        if front:
+            queue.insert(0, queue_item)
+            position = 0
+            if self.fair:
+                self._rekey(chat_id)
+        elif self.fair:
+            # Each requester gets one song per round; rounds start at the current song's
+            base = queue[0].get("fair_round", 0) if queue else 0
+            fair_round = max(stats["rounds"].get(requested_by, base - 1) + 1, base)
+            queue_item["fair_round"] = fair_round
+            queue_item["fair_seq"] = next(self._seq)
+            stats["rounds"][requested_by] = fair_round
+            
+            # Binary search for the slot, never in front of the current song
+            position = bisect.bisect_right(
+                queue, _fair_key(queue_item), lo=min(1, len(queue)), key=_fair_key
+            )
+            queue.insert(position, queue_item)
+        else:
+            queue.append(queue_item)
+            position = len(queue) - 1
+        
+        self._track_added(chat_id, queue_item)
         
         # Return position in queue (0-indexed)
-        return len(queue) - 1
+        return position
     
     def get_current(self, chat_id: int) -> Optional[Dict[str, Any]]:
         """Get the current song playing in a chat."""
         queue = self.get_queue(chat_id)
         return queue[0] if queue else None
     
-    def skip(self, chat_id: int) -> Optional[Dict[str, Any]]:
-        """Skip the current song and return the next song."""
+    def skip(self, chat_id: int, count: int = 1) -> Optional[Dict[str, Any]]:
+        """Skip the current song (and ``count - 1`` more) and return the next song."""
         queue = self.get_queue(chat_id)
         if not queue:
             return None
         
-        # Remove the current song
-        queue.pop(0)
+        # Remove the current song and any skipped ones in one go
+        removed = queue[:max(1, count)]
+        del queue[:max(1, count)]
+        self._track_removed(chat_id, removed)
         
         # Return the new current song or None if queue is empty
         return queue[0] if queue else None
     
+    def checkpoint(self, chat_id: int) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """Capture a chat's queue so a change can be undone if acting on it fails."""
+        stats = self._get_stats(chat_id)
+        stats = {key: dict(value) if isinstance(value, dict) else value for key, value in stats.items()}
+        return list(self.get_queue(chat_id)), stats
+    
+    def rollback(self, chat_id: int, checkpoint: Tuple[List[Dict[str, Any]], Dict[str, Any]]):
+        """Restore a queue captured with ``checkpoint``."""
+        self.queues[chat_id], self.stats[chat_id] = checkpoint
+    
     def clear_queue(self, chat_id: int) -> bool:
         """Clear the queue for a chat."""
         if chat_id in self.queues:
             self.queues[chat_id] = []
+            self.stats.pop(chat_id, None)
             return True
         return False
     
@@ -84,7 +182,54 @@ class MusicQueue:
         if position < 0 or position >= len(queue):
             return False
         
-        queue.pop(position)
+        self._track_removed(chat_id, [queue.pop(position)])
+        if self.fair:
+            self._recount_rounds(chat_id)
+        return True
+    
+    def remove_item(self, chat_id: int, item: Dict[str, Any]) -> bool:
+        """Remove a specific queue entry, wherever it has moved to."""
+        queue = self.get_queue(chat_id)
+        for position, queued in enumerate(queue):
+            if queued is item:
+                return self.remove_from_queue(chat_id, position)
+        return False
+    
+    def remove_range(self, chat_id: int, start: int, end: int) -> int:
+        """Remove the songs from position ``start`` to ``end`` (inclusive) and return how many were removed."""
+        queue = self.get_queue(chat_id)
+        if start < 0 or start >= len(queue) or end < start:
+            return 0
+        
+        end = min(end, len(queue) - 1)
+        removed = queue[start:end + 1]
+        del queue[start:end + 1]
+        self._track_removed(chat_id, removed)
+        if self.fair:
+            self._recount_rounds(chat_id)
+        return len(removed)
+    
+    def jump(self, chat_id: int, position: int) -> Optional[Dict[str, Any]]:
+        """Replace the current song with the one at ``position`` and return it."""
+        queue = self.get_queue(chat_id)
+        if position < 1 or position >= len(queue):
+            return None
+        
+        self._track_removed(chat_id, [queue[0]])
+        queue[0] = queue.pop(position)
+        return queue[0]
+    
+    def shuffle(self, chat_id: int) -> bool:
+        """Shuffle the songs after the current one."""
+        queue = self.get_queue(chat_id)
+        if len(queue) < 3:
+            return False
+        
+        upcoming = queue[1:]
+        random.shuffle(upcoming)
+        queue[1:] = upcoming
+        if self.fair:
+            self._rekey(chat_id)
         return True
     
     def move_in_queue(self, chat_id: int, old_pos: int, new_pos: int) -> bool:
@@ -95,19 +240,73 @@ class MusicQueue:
         
         item = queue.pop(old_pos)
         queue.insert(new_pos, item)
+        if self.fair:
+            self._rekey(chat_id)
         return True
     
+    def prune_empty(self, keep: Optional[Set[int]] = None) -> int:
+        """Drop empty queues for chats that are not in ``keep`` and return how many were removed."""
+        keep = keep or set()
+        empty = [
+            chat_id for chat_id, queue in self.queues.items()
+            if not queue and chat_id not in keep
+        ]
+        for chat_id in empty:
+            del self.queues[chat_id]
+            self.stats.pop(chat_id, None)
+        return len(empty)
+    
+    def save_snapshot(self, path: str) -> int:
+        """Write all non-empty queues to a JSON file and return how many were saved."""
+        snapshot = {
+            str(chat_id): queue for chat_id, queue in self.queues.items() if queue
+        }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"saved_at": time.time(), "queues": snapshot}, f, default=str)
+        os.replace(tmp_path, path)
+        return len(snapshot)
+    
+    def load_snapshot(self, path: str, max_age: float) -> int:
+        """Restore the queues written by ``save_snapshot`` and return how many were loaded.
+        
+        The file is removed once read, and ignored if it is older than ``max_age`` seconds.
+        """
+        if not os.path.exists(path):
+            return 0
+        with open(path) as f:
+            snapshot = json.load(f)
+        os.remove(path)
+        if time.time() - snapshot.get("saved_at", 0) > max_age:
+            return 0
+        
+        loaded = 0
+        for chat_id, queue in snapshot.get("queues", {}).items():
+            chat_id = int(chat_id)
+            if self.get_queue(chat_id) or not queue:
+                continue
+            self.queues[chat_id] = queue[:self.max_size]
+            self.stats.pop(chat_id, None)
+            for item in self.queues[chat_id]:
+                self._track_added(chat_id, item)
+            if self.fair:
+                self._rekey(chat_id)
+            loaded += 1
+        return loaded
+    
     def get_queue_stats(self, chat_id: int) -> Dict[str, Any]:
         """Get statistics about the queue."""
         queue = self.get_queue(chat_id)
-        total_duration = sum(item.get('duration', 0) for item in queue)
+        stats = self._get_stats(chat_id)
         
         return {
             "size": len(queue),
-            "total_duration": total_duration,
+            "total_duration": stats["total_duration"],
             "max_size": self.max_size,
-            "remaining": self.max_size - len(queue)
+            "remaining": self.max_size - len(queue),
+            "requesters": len(stats["per_user"]),
+            "max_per_user": self.max_per_user
         }
 
 # Create global music queue instance
-music_queue = MusicQueue()
+music_queue = MusicQueue(MAX_PLAYLIST_SIZE, fair=FAIR_QUEUE, max_per_user=MAX_SONGS_PER_USER)
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+from typing import Dict, Optional
+
+from queues import music_queue
+from config import (
+    ACTIVE_CALLS,
+    REAPER_INTERVAL,
+    IDLE_TIMEOUT,
+    PAUSED_TIMEOUT,
+    NO_LISTENER_TIMEOUT,
+    PREJOIN_TIMEOUT,
+)
+
+logger = logging.getLogger("reaper")
+
+# Calls checked at once; each listener count is a Telegram request
+MAX_CONCURRENT_CHECKS = 8
+
+class IdleReaper:
+    """Background task that leaves abandoned voice chats and prunes empty queues."""
+
+    def __init__(self, player, interval: int = REAPER_INTERVAL):
+        self.player = player
+        self.interval = interval
+        self.alone_since: Dict[int, float] = {}
+        self.totals = {"idle": 0, "paused": 0, "no_listeners": 0, "prejoined": 0, "stale_calls": 0, "queues": 0}
+        self.last_report: Optional[Dict[str, int]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Start the reaper loop."""
+        if self.interval <= 0:
+            logger.info("Idle reaper disabled.")
+            return
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Idle reaper started (interval {self.interval}s).")
+
+    async def stop(self):
+        """Stop the reaper loop."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.reap()
+            except Exception as e:
+                logger.error(f"Error in idle reaper: {e}")
+
+    async def reap(self) -> Dict[str, int]:
+        """Run a single reaping pass and return what was reclaimed."""
+        now = asyncio.get_event_loop().time()
+        report = {"idle": 0, "paused": 0, "no_listeners": 0, "prejoined": 0, "stale_calls": 0, "queues": 0}
+
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_CHECKS)
+
+        async def check(chat_id: int, stream: Dict) -> Optional[str]:
+            async with semaphore:
+                reason = await self._check_stream(chat_id, stream, now)
+            if reason and await self.player.stop(chat_id):
+                logger.info(f"Left voice chat in {chat_id} ({reason})")
+                return reason
+            return None
+
+        streams = list(self.player.get_active_streams().items())
+        for reason in await asyncio.gather(*(check(chat_id, stream) for chat_id, stream in streams)):
+            if reason:
+                report[reason] += 1
+
+        # Calls joined for a /play whose song never started
+        if PREJOIN_TIMEOUT:
+            for chat_id, joined_at in list(self.player.prejoined_at.items()):
+                if now - joined_at > PREJOIN_TIMEOUT and await self.player.abandon_prejoin(chat_id):
+                    logger.info(f"Left pre-joined voice chat in {chat_id} (prejoined)")
+                    report["prejoined"] += 1
+
+        # Calls we still track but no longer stream to
+        active = self.player.get_active_streams()
+        for chat_id in [chat_id for chat_id in ACTIVE_CALLS if chat_id not in active]:
+            del ACTIVE_CALLS[chat_id]
+            report["stale_calls"] += 1
+
+        for chat_id in [chat_id for chat_id in self.alone_since if chat_id not in active]:
+            del self.alone_since[chat_id]
+
+        report["queues"] = music_queue.prune_empty(keep=set(active))
+
+        for key, value in report.items():
+            self.totals[key] += value
+        self.last_report = report
+
+        if any(report.values()):
+            logger.info(
+                f"Reaper reclaimed {report['idle']} idle, {report['paused']} paused, "
+                f"{report['no_listeners']} empty calls, {report['prejoined']} unused pre-joined calls, "
+                f"{report['stale_calls']} stale call records "
+                f"and {report['queues']} empty queues"
+            )
+        return report
+
+    async def _check_stream(self, chat_id: int, stream: Dict, now: float) -> Optional[str]:
+        """Return the reason a call should be left, or None to keep it."""
+        paused_at = stream.get("paused_at")
+        if PAUSED_TIMEOUT and paused_at is not None and now - paused_at > PAUSED_TIMEOUT:
+            return "paused"
+
+        # The current song stays at the head of the queue, so idle means nothing after it
+        # and it has run out without its stream end arriving
+        last_activity = stream.get("last_activity", stream.get("started_at", now))
+        if (
+            IDLE_TIMEOUT
+            and not music_queue.has_next(chat_id)
+            and self.player.is_finished(chat_id)
+            and now - last_activity > IDLE_TIMEOUT
+        ):
+            return "idle"
+
+        if NO_LISTENER_TIMEOUT:
+            listeners = await self.player.get_listener_count(chat_id)
+            if listeners == 0:
+                alone_since = self.alone_since.setdefault(chat_id, now)
+                if now - alone_since > NO_LISTENER_TIMEOUT:
+                    return "no_listeners"
+            else:
+                self.alone_since.pop(chat_id, None)
+
+        return None
@@ -1,25 +1,60 @@
 
 import asyncio
+import itertools
 import logging
+import time
 from typing import Dict, Optional, Any, Callable
 from pyrogram import Client
 from pytgcalls import PyTgCalls
 from pytgcalls.types import MediaStream, AudioQuality, GroupCallConfig
 from pytgcalls.exceptions import NoActiveGroupCall
 
+import sources
+from sources import registry
+from filecache import file_cache
 from queues import music_queue
-from config import ACTIVE_CALLS, MESSAGES
+from history import play_history
+from autoplay import autoplay, AUTOPLAY_USER_ID, PREFETCH_WAIT
+from effects import audio_effects, tempo
+from groupcalls import group_calls
+from config import ACTIVE_CALLS, MESSAGES, LIVE_REFRESH_MARGIN, LIVE_MAX_RECONNECTS, PREJOIN
+from metrics import STREAM_TRANSITION
+from tracing import detached_task, span
+from actors import ChatActors
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("stream")
 
+# ffmpeg input options for live sources: keep reconnecting instead of ending the stream
+LIVE_FFMPEG_PARAMETERS = "-reconnect 1 -reconnect_streamed 1 -reconnect_on_network_error 1 -reconnect_delay_max 10"
+
+# HLS only: start near the live edge and ride out slow playlist updates
+HLS_FFMPEG_PARAMETERS = "-live_start_index -2 -max_reload 30 -m3u8_hold_counters 30"
+
+# A Telegram file still downloading: keep reading at EOF until no data arrives for 10s.
+# The stream is restarted on the complete file once the download finishes.
+GROWING_FILE_FFMPEG_PARAMETERS = "-follow 1 -rw_timeout 10000000"
+
+# A live stream that drops sooner than this after (re)starting counts as a failed reconnect
+LIVE_MIN_UPTIME = 60
+
 class MusicPlayer:
-    def __init__(self, user_client: Client):
+    def __init__(self, user_client: Client, py_tgcalls: Optional[PyTgCalls] = None, prejoin: bool = PREJOIN):
         self.user_client = user_client
-        self.py_tgcalls = PyTgCalls(user_client)
+        self.py_tgcalls = py_tgcalls or PyTgCalls(user_client)
         self.active_streams: Dict[int, Dict[str, Any]] = {}
         
+        # Voice chats joined ahead of their first song -> /play requests still resolving
+        self.prejoin_enabled = prejoin
+        self.prejoined: Dict[int, int] = {}
+        self.prejoined_at: Dict[int, float] = {}
+        self._generations = itertools.count(1)
+        self._live_refreshers: Dict[int, asyncio.Task] = {}
+        self._autoplay_waiters: Dict[int, asyncio.Task] = {}
+        self._download_followers: Dict[int, asyncio.Task] = {}
+        
+        # Control commands for a chat run one at a time through its actor
+        self.actors = ChatActors(self._execute)
+        
         # Set up callback handlers
         self.py_tgcalls.on_stream_end(self._on_stream_end)
         self.py_tgcalls.on_group_call_ended(self._on_group_call_ended)
@@ -29,31 +64,95 @@ class MusicPlayer:
         await self.py_tgcalls.start()
         logger.info("PyTgCalls client started.")
     
+    async def _execute(self, chat_id: int, command: str, *args) -> Any:
+        """Run a command for a chat; called by the chat's actor."""
+        return await getattr(self, f"_{command}")(chat_id, *args)
+    
     async def _on_stream_end(self, _, update):
         """Handle stream end event."""
         chat_id = update.chat_id
         logger.info(f"Stream ended in chat {chat_id}")
         
-        # Check if there are more songs in queue
-        if music_queue.has_next(chat_id):
-            await self.skip(chat_id)
-        else:
-            # No more songs, clean up
-            await self.stop(chat_id)
+        # Remember which stream ended so a stale event can't skip the next track
+        generation = self.active_streams.get(chat_id, {}).get("generation")
+        await self.actors.submit(chat_id, "stream_end", generation)
+    
+    async def _stream_end(self, chat_id: int, generation: Optional[int]) -> bool:
+        if self.active_streams.get(chat_id, {}).get("generation") != generation:
+            logger.info(f"Ignoring stale stream end in chat {chat_id}")
+            return False
+        
+        # A live stream only ends on its own if the connection dropped for good
+        song_info = self.active_streams.get(chat_id, {}).get("song_info", {})
+        if song_info.get("is_live") and await self._reconnect_live(chat_id):
+            return True
+        
+        # Check if there are more songs in queue, or autoplay has one lined up
+        if music_queue.has_next(chat_id) or autoplay.is_enabled(chat_id):
+            return await self._skip(chat_id, 1, "stream_end")
+        
+        # No more songs, clean up
+        return await self._stop(chat_id)
     
     async def _on_group_call_ended(self, _, update):
         """Handle group call ended event."""
         chat_id = update.chat_id
         logger.info(f"Group call ended in chat {chat_id}")
-        
+        group_calls.set(chat_id, False)
+        await self.actors.submit(chat_id, "group_call_ended")
+    
+    async def _group_call_ended(self, chat_id: int) -> bool:
         # Clean up
+        self.prejoined.pop(chat_id, None)
+        self.prejoined_at.pop(chat_id, None)
+        self._cancel_live_refresh(chat_id)
+        self._cancel_autoplay_wait(chat_id)
+        self._cancel_download_follow(chat_id)
+        self._record_play(chat_id)
+        autoplay.clear(chat_id)
         if chat_id in self.active_streams:
             del self.active_streams[chat_id]
+            
+            # The current song stopped with the call; the rest stay queued
+            music_queue.remove_from_queue(chat_id, 0)
         
         if chat_id in ACTIVE_CALLS:
             del ACTIVE_CALLS[chat_id]
+        
+        return True
+    
+    @staticmethod
+    def _media_stream(
+        file_path,
+        song_info: Optional[Dict[str, Any]] = None,
+        chat_id: Optional[int] = None,
+        position: float = 0.0
+    ) -> MediaStream:
+        """Build the audio-only stream for a track, with the chat's audio effects from ``position`` seconds."""
+        effect_parameters = None
+        if chat_id is not None:
+            file_path, effect_parameters = audio_effects.stream_input(chat_id, song_info or {}, file_path, position)
+        
+        ffmpeg_parameters = None
+        if song_info and song_info.get("is_live"):
+            ffmpeg_parameters = LIVE_FFMPEG_PARAMETERS
+            if "m3u8" in (song_info.get("protocol") or "") or ".m3u8" in str(file_path):
+                ffmpeg_parameters += " " + HLS_FFMPEG_PARAMETERS
+        elif file_cache.is_downloading(str(file_path)):
+            ffmpeg_parameters = GROWING_FILE_FFMPEG_PARAMETERS
+        
+        # Input options come first; the effect filters follow -atmid, after the input
+        if effect_parameters:
+            ffmpeg_parameters = f"{ffmpeg_parameters} {effect_parameters}" if ffmpeg_parameters else effect_parameters
+        
+        return MediaStream(
+            file_path,
+            audio_parameters=AudioQuality.STUDIO,
+            video_flags=MediaStream.Flags.IGNORE,
+            ffmpeg_parameters=ffmpeg_parameters,
+        )
     
-    async def join_call(self, chat_id: int, file_path) -> bool:
+    async def join_call(self, chat_id: int, file_path, song_info: Optional[Dict[str, Any]] = None) -> bool:
         """Join a voice chat."""
         try:
             # Check if already in call
@@ -61,26 +160,25 @@ class MusicPlayer:
                 return True
             
             # Get group call instance
-            await self.py_tgcalls.play(
-                chat_id,
-                MediaStream(
-                    file_path,
-                    audio_parameters=AudioQuality.STUDIO,
-                    video_flags=MediaStream.Flags.IGNORE,
-                ),
-                GroupCallConfig(auto_start=False),
-            )
+            with span("player.join_call", chat_id=chat_id):
+                await self.py_tgcalls.play(
+                    chat_id,
+                    self._media_stream(file_path, song_info, chat_id),
+                    GroupCallConfig(auto_start=False),
+                )
             
             # Update active calls
             ACTIVE_CALLS[chat_id] = {
                 "joined_at": asyncio.get_event_loop().time(),
                 "active": True
             }
+            group_calls.set(chat_id, True)
             
             return True
         
         except NoActiveGroupCall:
             logger.error(f"No active group call in chat {chat_id}")
+            group_calls.set(chat_id, False)
             return False
         
         except Exception as e:
@@ -91,6 +189,11 @@ class MusicPlayer:
         """Leave a voice chat."""
         try:
             if chat_id in self.active_streams:
+                self._cancel_live_refresh(chat_id)
+                self._cancel_autoplay_wait(chat_id)
+                self._cancel_download_follow(chat_id)
+                self._record_play(chat_id)
+                autoplay.clear(chat_id)
                 await self.py_tgcalls.leave_call(chat_id)
                 
                 # Clean up
@@ -108,20 +211,143 @@ class MusicPlayer:
             logger.error(f"Error leaving voice chat in {chat_id}: {e}")
             return False
     
+    async def leave_all(self) -> int:
+        """Leave every voice chat and return how many were left cleanly."""
+        # Through the actors, so a command still running in a chat finishes first
+        results = await asyncio.gather(
+            *(self.actors.submit(chat_id, "stop") for chat_id in list(self.active_streams)),
+            *(self.actors.submit(chat_id, "abandon_prejoin") for chat_id in list(self.prejoined)),
+            return_exceptions=True
+        )
+        return sum(1 for result in results if result is True)
+    
     async def play(self, chat_id: int, audio_url: str, song_info: Dict[str, Any]) -> bool:
         """Play a song in a voice chat."""
+        return await self.actors.submit(chat_id, "play", audio_url, song_info)
+    
+    async def pause(self, chat_id: int) -> bool:
+        """Pause playback."""
+        return await self.actors.submit(chat_id, "pause")
+    
+    async def resume(self, chat_id: int) -> bool:
+        """Resume playback."""
+        return await self.actors.submit(chat_id, "resume")
+    
+    async def stop(self, chat_id: int) -> bool:
+        """Stop playback and leave voice chat."""
+        return await self.actors.submit(chat_id, "stop")
+    
+    async def skip(self, chat_id: int, count: int = 1) -> bool:
+        """Skip ``count`` songs and play the next one if available."""
+        return await self.actors.submit(chat_id, "skip", count)
+    
+    async def set_volume(self, chat_id: int, volume: int) -> bool:
+        """Set volume (1-200)."""
+        return await self.actors.submit(chat_id, "set_volume", volume)
+    
+    async def jump(self, chat_id: int, position: int) -> Optional[Dict[str, Any]]:
+        """Play the song at ``position`` now and return it, keeping the songs before it queued."""
+        return await self.actors.submit(chat_id, "jump", position)
+    
+    async def remove(self, chat_id: int, start: int, end: Optional[int] = None) -> int:
+        """Remove upcoming songs from ``start`` to ``end`` and return how many were removed."""
+        return await self.actors.submit(chat_id, "remove", start, end if end is not None else start)
+    
+    async def move(self, chat_id: int, old_pos: int, new_pos: int) -> bool:
+        """Move an upcoming song to another position."""
+        return await self.actors.submit(chat_id, "move", old_pos, new_pos)
+    
+    async def shuffle(self, chat_id: int) -> bool:
+        """Shuffle the upcoming songs."""
+        return await self.actors.submit(chat_id, "shuffle")
+    
+    async def prejoin(self, chat_id: int) -> bool:
+        """Join a chat's voice chat before its first song is ready; pair with ``release_prejoin``."""
+        return await self.actors.submit(chat_id, "prejoin")
+    
+    async def release_prejoin(self, chat_id: int) -> bool:
+        """Leave a pre-joined voice chat if no song ended up playing in it."""
+        return await self.actors.submit(chat_id, "release_prejoin")
+    
+    async def abandon_prejoin(self, chat_id: int) -> bool:
+        """Leave a pre-joined voice chat whatever /play requests still wait on it."""
+        return await self.actors.submit(chat_id, "abandon_prejoin")
+    
+    async def apply_effects(self, chat_id: int) -> bool:
+        """Restart the current song where it is with the chat's current audio effects."""
+        return await self.actors.submit(chat_id, "apply_effects")
+    
+    def _position(self, chat_id: int) -> float:
+        """Seconds into the current song, in the song's own time."""
+        stream = self.active_streams[chat_id]
+        now = asyncio.get_event_loop().time()
+        played = (stream.get("paused_at") or now) - stream["started_at"] - stream.get("paused_total", 0.0)
+        return stream.get("offset", 0.0) + max(0.0, played) * stream.get("rate", 1.0)
+    
+    def _record_play(self, chat_id: int):
+        """Add the current song to the play history, once, as it stops playing."""
+        stream = self.active_streams.get(chat_id)
+        if stream is None or stream.get("recorded"):
+            return
+        
+        stream["recorded"] = True
+        play_history.record(chat_id, stream["song_info"], self._position(chat_id))
+    
+    async def _play(
+        self,
+        chat_id: int,
+        audio_url: str,
+        song_info: Dict[str, Any],
+        refresh: bool = False,
+        position: float = 0.0
+    ) -> bool:
         try:
+            previous = self.active_streams.get(chat_id)
+            
+            # A live refresh carries on the same song
+            if previous is not None and not refresh:
+                self._record_play(chat_id)
+            
             # Join call if not already in call
-            if chat_id not in self.active_streams:
-                success = await self.join_call(chat_id, audio_url)
+            if previous is None:
+                success = await self.join_call(chat_id, audio_url, song_info)
                 if not success:
                     return False
+            else:
+                # Switch the running call over to the new track
+                with span("player.change_stream", chat_id=chat_id):
+                    await self.py_tgcalls.play(
+                        chat_id, self._media_stream(audio_url, song_info, chat_id, position)
+                    )
+            
+            # A pre-joined call has its song now
+            self.prejoined.pop(chat_id, None)
+            self.prejoined_at.pop(chat_id, None)
             
             # Update active streams
+            now = asyncio.get_event_loop().time()
+            generation = next(self._generations)
             self.active_streams[chat_id] = {
-                "started_at": asyncio.get_event_loop().time(),
-                "song_info": song_info
+                "started_at": now,
+                "last_activity": now,
+                "generation": generation,
+                "song_info": song_info,
+                "audio_url": audio_url,
+                "offset": position,
+                "rate": tempo(audio_effects.get(chat_id), song_info.get("is_live", False))
             }
+            if previous and "volume" in previous:
+                self.active_streams[chat_id]["volume"] = previous["volume"]
+            
+            self._cancel_live_refresh(chat_id)
+            self._cancel_download_follow(chat_id)
+            if song_info.get("is_live"):
+                self._schedule_live_refresh(chat_id, generation, song_info.get("webpage_url", ""), audio_url)
+            elif file_cache.is_downloading(audio_url):
+                self._follow_download(chat_id, generation, audio_url)
+            if not refresh:
+                autoplay.played(chat_id, song_info, music_queue.has_next(chat_id))
+                audio_effects.played(chat_id, song_info, audio_url)
             
             return True
         
@@ -129,12 +355,169 @@ class MusicPlayer:
             logger.error(f"Error playing song in {chat_id}: {e}")
             return False
     
-    async def pause(self, chat_id: int) -> bool:
-        """Pause playback."""
+    async def _prejoin(self, chat_id: int) -> bool:
+        if chat_id in self.active_streams:
+            return True
+        if chat_id in self.prejoined:
+            self.prejoined[chat_id] += 1
+            return True
+        
+        try:
+            # Joining without a stream; the first song is switched in when it's resolved
+            with span("player.prejoin", chat_id=chat_id):
+                await self.py_tgcalls.play(chat_id, None, GroupCallConfig(auto_start=False))
+        
+        except NoActiveGroupCall:
+            group_calls.set(chat_id, False)
+            return False
+        
+        except Exception as e:
+            logger.error(f"Error pre-joining voice chat in {chat_id}: {e}")
+            return False
+        
+        group_calls.set(chat_id, True)
+        self.prejoined[chat_id] = 1
+        self.prejoined_at[chat_id] = asyncio.get_event_loop().time()
+        return True
+    
+    async def _release_prejoin(self, chat_id: int) -> bool:
+        waiting = self.prejoined.get(chat_id)
+        if waiting is None:
+            return False
+        if waiting > 1:
+            self.prejoined[chat_id] = waiting - 1
+            return False
+        
+        del self.prejoined[chat_id]
+        del self.prejoined_at[chat_id]
+        try:
+            await self.py_tgcalls.leave_call(chat_id)
+            logger.info(f"Left pre-joined voice chat in {chat_id}, nothing to play")
+            return True
+        
+        except Exception as e:
+            logger.error(f"Error leaving pre-joined voice chat in {chat_id}: {e}")
+            return False
+    
+    async def _abandon_prejoin(self, chat_id: int) -> bool:
+        if chat_id not in self.prejoined:
+            return False
+        
+        # The /play requests still holding it just find it released
+        self.prejoined[chat_id] = 1
+        return await self._release_prejoin(chat_id)
+    
+    def _schedule_live_refresh(self, chat_id: int, generation: int, url: str, audio_url: str):
+        """Re-resolve a live stream shortly before its signed manifest URL expires."""
+        expires_at = registry.expires_at(url, audio_url)
+        if expires_at is None:
+            return
+        
+        # At most once a minute, even if the URL is already close to expiring
+        delay = max(LIVE_MIN_UPTIME, expires_at - time.time() - LIVE_REFRESH_MARGIN)
+        self._live_refreshers[chat_id] = detached_task(
+            self._refresh_later(chat_id, generation, delay), name=f"live-refresh-{chat_id}"
+        )
+    
+    def _cancel_live_refresh(self, chat_id: int):
+        task = self._live_refreshers.pop(chat_id, None)
+        if task is not None:
+            task.cancel()
+    
+    async def _refresh_later(self, chat_id: int, generation: int, delay: float):
+        await asyncio.sleep(delay)
+        
+        # The refresh replaces this task with the one for the new manifest
+        if self._live_refreshers.get(chat_id) is asyncio.current_task():
+            del self._live_refreshers[chat_id]
+        
+        if not await self.actors.submit(chat_id, "refresh_live", generation):
+            logger.warning(f"Could not refresh the live stream in chat {chat_id}")
+    
+    async def _refresh_live(self, chat_id: int, generation: Optional[int] = None) -> bool:
+        """Switch a live stream over to a freshly resolved manifest URL."""
+        stream = self.active_streams.get(chat_id)
+        if stream is None or (generation is not None and stream["generation"] != generation):
+            return False
+        
+        song_info = stream["song_info"]
+        info, audio_url = await registry.resolve(song_info["webpage_url"], live=True, use_cache=False)
+        if info is None or not sources.is_live(info):
+            logger.info(f"Live stream in chat {chat_id} is no longer live")
+            return False
+        
+        logger.info(f"Refreshing live stream in chat {chat_id}")
+        return await self._play(
+            chat_id,
+            audio_url,
+            {**song_info, "audio_url": audio_url, "protocol": info.get("protocol")},
+            refresh=True
+        )
+    
+    async def _reconnect_live(self, chat_id: int) -> bool:
+        """Restart a dropped live stream unless it keeps dropping right away."""
+        stream = self.active_streams[chat_id]
+        uptime = asyncio.get_event_loop().time() - stream["started_at"]
+        failures = stream.get("live_failures", 0) + 1 if uptime < LIVE_MIN_UPTIME else 0
+        if failures > LIVE_MAX_RECONNECTS:
+            logger.warning(f"Giving up on live stream in chat {chat_id} after {failures - 1} reconnects")
+            return False
+        
+        if not await self._refresh_live(chat_id):
+            return False
+        
+        self.active_streams[chat_id]["live_failures"] = failures
+        return True
+    
+    def _follow_download(self, chat_id: int, generation: int, path: str):
+        """Restart a stream that follows a growing file on the whole file once it is downloaded."""
+        self._download_followers[chat_id] = detached_task(
+            self._download_finished_later(chat_id, generation, path), name=f"download-follow-{chat_id}"
+        )
+    
+    def _cancel_download_follow(self, chat_id: int):
+        task = self._download_followers.pop(chat_id, None)
+        if task is not None:
+            task.cancel()
+    
+    async def _download_finished_later(self, chat_id: int, generation: int, path: str):
+        complete = await file_cache.wait_downloaded(path)
+        if self._download_followers.get(chat_id) is asyncio.current_task():
+            del self._download_followers[chat_id]
+        
+        # A failed download ends the stream on its own
+        if complete:
+            await self.actors.submit(chat_id, "download_finished", generation)
+    
+    async def _download_finished(self, chat_id: int, generation: int) -> bool:
+        stream = self.active_streams.get(chat_id)
+        if stream is None or stream["generation"] != generation:
+            return False
+        
+        # Without -follow, ffmpeg ends the stream at EOF instead of waiting out rw_timeout
+        return await self._restart(chat_id, "download")
+    
+    async def _restart(self, chat_id: int, reason: str) -> bool:
+        """Restart the current song where it is, keeping it paused if it was."""
+        stream = self.active_streams[chat_id]
+        paused = stream.get("paused", False)
+        with STREAM_TRANSITION.time(reason=reason):
+            success = await self._play(
+                chat_id, stream["audio_url"], stream["song_info"], refresh=True, position=self._position(chat_id)
+            )
+        if not success:
+            return False
+        
+        if paused:
+            await self._pause(chat_id)
+        return True
+    
+    async def _pause(self, chat_id: int) -> bool:
         try:
             if chat_id in self.active_streams:
                 await self.py_tgcalls.pause(chat_id)
                 self.active_streams[chat_id]["paused"] = True
+                self.active_streams[chat_id]["paused_at"] = asyncio.get_event_loop().time()
                 return True
             
             return False
@@ -143,12 +526,16 @@ class MusicPlayer:
             logger.error(f"Error pausing playback in {chat_id}: {e}")
             return False
     
-    async def resume(self, chat_id: int) -> bool:
-        """Resume playback."""
+    async def _resume(self, chat_id: int) -> bool:
         try:
             if chat_id in self.active_streams and self.active_streams[chat_id].get("paused", False):
                 await self.py_tgcalls.resume(chat_id)
-                self.active_streams[chat_id]["paused"] = False
+                stream = self.active_streams[chat_id]
+                stream["paused"] = False
+                paused_at = stream.pop("paused_at", None)
+                if paused_at is not None:
+                    stream["paused_total"] = stream.get("paused_total", 0.0) + asyncio.get_event_loop().time() - paused_at
+                self._touch(chat_id)
                 return True
             
             return False
@@ -157,8 +544,7 @@ class MusicPlayer:
             logger.error(f"Error resuming playback in {chat_id}: {e}")
             return False
     
-    async def stop(self, chat_id: int) -> bool:
-        """Stop playback and leave voice chat."""
+    async def _stop(self, chat_id: int) -> bool:
         try:
             if chat_id in self.active_streams:
                 # Clear queue first
@@ -174,29 +560,141 @@ class MusicPlayer:
             logger.error(f"Error stopping playback in {chat_id}: {e}")
             return False
     
-    async def skip(self, chat_id: int) -> bool:
-        """Skip current song and play next if available."""
+    async def _skip(self, chat_id: int, count: int = 1, reason: str = "skip") -> bool:
+        # If the switch fails the skipped songs go back, in step with what is still playing
+        checkpoint = music_queue.checkpoint(chat_id)
         try:
-            # Skip current song in queue
-            next_song = music_queue.skip(chat_id)
+            # Skip current song (and any further ones) in queue
+            next_song = music_queue.skip(chat_id, count) or self._autoplay_next(chat_id)
             
             if next_song:
                 # Play next song
                 audio_url = next_song.get("audio_url")
+                success = False
                 if audio_url:
-                    return await self.play(chat_id, audio_url, next_song)
-                return False
+                    with STREAM_TRANSITION.time(reason=reason):
+                        success = await self._play(chat_id, audio_url, next_song)
+                if not success:
+                    music_queue.rollback(chat_id, checkpoint)
+                return success
+            elif self._wait_for_autoplay(chat_id):
+                # The related track is still resolving; it is played once ready
+                return True
             else:
                 # No more songs, stop playback
-                await self.stop(chat_id)
+                await self._stop(chat_id)
                 return True
         
         except Exception as e:
             logger.error(f"Error skipping song in {chat_id}: {e}")
+            music_queue.rollback(chat_id, checkpoint)
             return False
     
-    async def set_volume(self, chat_id: int, volume: int) -> bool:
-        """Set volume (1-200)."""
+    def _autoplay_next(self, chat_id: int) -> Optional[Dict[str, Any]]:
+        """Queue the chat's prefetched autoplay track, if it is ready."""
+        song = autoplay.next_song(chat_id)
+        if song is None or music_queue.add_to_queue(chat_id, song, AUTOPLAY_USER_ID) < 0:
+            return None
+        return music_queue.get_current(chat_id)
+    
+    def _wait_for_autoplay(self, chat_id: int) -> bool:
+        """Follow an autoplay prefetch in progress outside the actor, so other commands aren't held up."""
+        task = autoplay.pending(chat_id)
+        if task is None or chat_id not in self.active_streams:
+            return False
+        
+        self._cancel_autoplay_wait(chat_id)
+        generation = self.active_streams[chat_id]["generation"]
+        self._autoplay_waiters[chat_id] = detached_task(
+            self._autoplay_later(chat_id, task, generation), name=f"autoplay-wait-{chat_id}"
+        )
+        return True
+    
+    def _cancel_autoplay_wait(self, chat_id: int):
+        task = self._autoplay_waiters.pop(chat_id, None)
+        if task is not None:
+            task.cancel()
+    
+    async def _autoplay_later(self, chat_id: int, task: asyncio.Task, generation: int):
+        await asyncio.wait({task}, timeout=PREFETCH_WAIT)
+        if self._autoplay_waiters.get(chat_id) is asyncio.current_task():
+            del self._autoplay_waiters[chat_id]
+        await self.actors.submit(chat_id, "autoplay_ready", generation)
+    
+    async def _autoplay_ready(self, chat_id: int, generation: int) -> bool:
+        # Anything played or stopped since the skip takes precedence
+        stream = self.active_streams.get(chat_id)
+        if stream is None or stream["generation"] != generation:
+            return False
+        
+        try:
+            next_song = music_queue.get_current(chat_id) or self._autoplay_next(chat_id)
+            if next_song and next_song.get("audio_url"):
+                with STREAM_TRANSITION.time(reason="autoplay"):
+                    return await self._play(chat_id, next_song["audio_url"], next_song)
+            
+            logger.warning(f"Autoplay track for chat {chat_id} not ready in time")
+            await self._stop(chat_id)
+            return False
+        
+        except Exception as e:
+            logger.error(f"Error starting autoplay track in {chat_id}: {e}")
+            return False
+    
+    async def _jump(self, chat_id: int, position: int) -> Optional[Dict[str, Any]]:
+        checkpoint = music_queue.checkpoint(chat_id)
+        try:
+            next_song = music_queue.jump(chat_id, position)
+            if not next_song:
+                return None
+            
+            # Switch the stream once, straight to the target
+            success = False
+            if next_song.get("audio_url"):
+                with STREAM_TRANSITION.time(reason="jump"):
+                    success = await self._play(chat_id, next_song["audio_url"], next_song)
+            if not success:
+                music_queue.rollback(chat_id, checkpoint)
+                return None
+            return next_song
+        
+        except Exception as e:
+            logger.error(f"Error jumping in queue in {chat_id}: {e}")
+            music_queue.rollback(chat_id, checkpoint)
+            return None
+    
+    async def _remove(self, chat_id: int, start: int, end: int) -> int:
+        # The current song can only be replaced by skipping
+        if start < 1:
+            return 0
+        return music_queue.remove_range(chat_id, start, end)
+    
+    async def _move(self, chat_id: int, old_pos: int, new_pos: int) -> bool:
+        if old_pos < 1 or new_pos < 1:
+            return False
+        return music_queue.move_in_queue(chat_id, old_pos, new_pos)
+    
+    async def _shuffle(self, chat_id: int) -> bool:
+        return music_queue.shuffle(chat_id)
+    
+    async def _apply_effects(self, chat_id: int) -> bool:
+        try:
+            stream = self.active_streams.get(chat_id)
+            if stream is None:
+                return False
+            
+            if not await self._restart(chat_id, "effects"):
+                return False
+            
+            audio_effects.played(chat_id, stream["song_info"], stream["audio_url"])
+            self._touch(chat_id)
+            return True
+        
+        except Exception as e:
+            logger.error(f"Error applying effects in {chat_id}: {e}")
+            return False
+    
+    async def _set_volume(self, chat_id: int, volume: int) -> bool:
         try:
             if chat_id in self.active_streams:
                 # Ensure volume is in valid range
@@ -204,6 +702,7 @@ class MusicPlayer:
                 
                 await self.py_tgcalls.change_volume_call(chat_id, volume)
                 self.active_streams[chat_id]["volume"] = volume
+                self._touch(chat_id)
                 return True
             
             return False
@@ -212,10 +711,35 @@ class MusicPlayer:
             logger.error(f"Error setting volume in {chat_id}: {e}")
             return False
     
+    async def get_listener_count(self, chat_id: int) -> Optional[int]:
+        """Count participants in the voice chat other than the assistant."""
+        try:
+            participants = await self.py_tgcalls.get_participants(chat_id)
+        except Exception as e:
+            logger.error(f"Error getting participants in {chat_id}: {e}")
+            return None
+        
+        me = self.user_client.me
+        own_id = me.id if me else None
+        return sum(1 for participant in participants if participant.user_id != own_id)
+    
+    def _touch(self, chat_id: int):
+        """Record activity in a chat so the idle reaper leaves it alone."""
+        if chat_id in self.active_streams:
+            self.active_streams[chat_id]["last_activity"] = asyncio.get_event_loop().time()
+    
     def is_playing(self, chat_id: int) -> bool:
         """Check if music is playing in the chat."""
         return chat_id in self.active_streams and not self.active_streams[chat_id].get("paused", False)
     
+    def is_finished(self, chat_id: int) -> bool:
+        """Check if the current song has played past its end, as when its stream end update was lost."""
+        stream = self.active_streams.get(chat_id)
+        if stream is None or stream["song_info"].get("is_live"):
+            return False
+        duration = stream["song_info"].get("duration")
+        return bool(duration) and self._position(chat_id) >= duration
+    
     def is_in_call(self, chat_id: int) -> bool:
         """Check if the bot is in a voice chat."""
         return chat_id in self.active_streams
@@ -223,4 +747,3 @@ class MusicPlayer:
     def get_active_streams(self) -> Dict[int, Dict[str, Any]]:
         """Get all active streams."""
         return self.active_streams.copy()
-        
@@ -0,0 +1,42 @@
+import asyncio
+import unittest
+
+from actors import ChatActors
+from tracing import span, start_trace
+
+class ChatActorTracingTest(unittest.IsolatedAsyncioTestCase):
+    async def test_commands_record_spans_in_their_own_trace(self):
+        async def execute(chat_id, command, *args):
+            with span(f"player.{command}"):
+                await asyncio.sleep(0)
+            return True
+
+        actors = ChatActors(execute)
+        try:
+            with start_trace("play") as play_trace:
+                await actors.submit(1, "play")
+            with start_trace("skip") as skip_trace:
+                await actors.submit(1, "skip", 1)
+        finally:
+            await actors.stop()
+
+        self.assertEqual([item.name for item in play_trace.spans], ["play", "player.play"])
+        self.assertEqual([item.name for item in skip_trace.spans], ["skip", "player.skip"])
+
+    async def test_untraced_command_records_nothing(self):
+        async def execute(chat_id, command, *args):
+            with span(f"player.{command}") as current:
+                return current
+
+        actors = ChatActors(execute)
+        try:
+            with start_trace("play") as play_trace:
+                await actors.submit(1, "play")
+            self.assertIsNone(await actors.submit(1, "stop"))
+        finally:
+            await actors.stop()
+
+        self.assertEqual(len(play_trace.spans), 2)
+
+if __name__ == "__main__":
+    unittest.main()
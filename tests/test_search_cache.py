@@ -0,0 +1,41 @@
+import time
+import unittest
+
+from sources import SearchCache
+
+def results(*titles):
+    return [{"id": str(index), "title": title} for index, title in enumerate(titles)]
+
+class SearchCacheNearMatchTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = SearchCache("search", max_size=16, grace=60)
+
+    def put(self, key, value):
+        self.cache.put(key, (key, value, 5), time.time() + 60)
+
+    def test_complete_word_does_not_match_longer_cached_word(self):
+        self.put("believer", results("Imagine Dragons - Believer"))
+        self.put("the chainsmokers closer", results("The Chainsmokers - Closer ft. Halsey"))
+
+        self.assertIsNone(self.cache.lookup("believe", 1, strict=True))
+        self.assertIsNone(self.cache.lookup("the chainsmokers close", 1, strict=True))
+
+    def test_near_match_whose_results_have_every_word(self):
+        self.put("daft punk get luck", results("Daft Punk - Get Lucky"))
+
+        cached = self.cache.lookup("daft punk get lucky", 1, strict=True)
+        self.assertEqual(cached[0], "daft punk get luck")
+
+    def test_loose_lookup_keeps_near_matches_for_suggestions(self):
+        self.put("believer", results("Imagine Dragons - Believer"))
+
+        cached = self.cache.lookup("believe", 5)
+        self.assertEqual(cached[0], "believer")
+
+    def test_extra_word_never_matches(self):
+        self.put("queen bohemian rhapsody", results("Queen - Bohemian Rhapsody"))
+
+        self.assertIsNone(self.cache.lookup("queen bohemian rhapsody live", 5))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,236 @@
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import os
+import time
+import urllib.request
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+from config import TRACE_BUFFER_SIZE, TRACE_LOG_ENABLED, TRACE_OTLP_ENDPOINT
+
+logger = logging.getLogger("tracing")
+trace_logger = logging.getLogger("trace")
+
+class Span:
+    """A timed stage within a request."""
+
+    def __init__(self, name: str, trace: "Trace", parent: Optional["Span"], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace = trace
+        self.parent = parent
+        self.span_id = os.urandom(8).hex()
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.error: Optional[str] = None
+
+    @property
+    def duration_ms(self) -> float:
+        end_ns = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end_ns - self.start_ns) / 1e6
+
+    @property
+    def depth(self) -> int:
+        depth, parent = 0, self.parent
+        while parent is not None:
+            depth, parent = depth + 1, parent.parent
+        return depth
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent.span_id if self.parent else None,
+            "start_ns": self.start_ns,
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+class Trace:
+    """All spans recorded for a single request."""
+
+    def __init__(self, name: str, attributes: Dict[str, Any]):
+        self.trace_id = uuid.uuid4().hex
+        self.request_id = self.trace_id[:12]
+        self.name = name
+        self.spans: List[Span] = []
+        self.root = Span(name, self, None, attributes)
+        self.spans.append(self.root)
+
+    @property
+    def duration_ms(self) -> float:
+        return self.root.duration_ms
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "request_id": self.request_id,
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "duration_ms": round(self.duration_ms, 3),
+            "spans": [span.to_dict() for span in self.spans],
+        }
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+RECENT_TRACES: Deque[Trace] = deque(maxlen=TRACE_BUFFER_SIZE)
+
+def current_request_id() -> Optional[str]:
+    """Return the request ID of the trace active in this task, if any."""
+    span = _current_span.get()
+    return span.trace.request_id if span else None
+
+@contextmanager
+def start_trace(name: str, **attributes) -> Iterator[Trace]:
+    """Start a new trace and make its root span current."""
+    trace = Trace(name, attributes)
+    token = _current_span.set(trace.root)
+    try:
+        yield trace
+    except BaseException as e:
+        trace.root.error = repr(e)
+        raise
+    finally:
+        trace.root.end_ns = time.time_ns()
+        _current_span.reset(token)
+        _finish(trace)
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Optional[Span]]:
+    """Record a nested span; does nothing outside of a trace."""
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+
+    child = Span(name, parent.trace, parent, attributes)
+    parent.trace.spans.append(child)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.error = repr(e)
+        raise
+    finally:
+        child.end_ns = time.time_ns()
+        _current_span.reset(token)
+
+def detached_task(coro, name: Optional[str] = None) -> asyncio.Task:
+    """Start a task outside of any trace, for work that outlives the request that started it."""
+    return contextvars.Context().run(asyncio.create_task, coro, name=name)
+
+def traced_handler(name: str):
+    """Decorator that wraps a Pyrogram handler in a new trace."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(client, update):
+            message = getattr(update, "message", None) or update
+            chat = getattr(message, "chat", None)
+            user = getattr(update, "from_user", None)
+            with start_trace(
+                name,
+                chat_id=chat.id if chat else None,
+                user_id=user.id if user else None
+            ):
+                return await func(client, update)
+        return wrapper
+    return decorator
+
+def instrument_client(client):
+    """Record a span for every Telegram API call made inside a trace."""
+    invoke = client.invoke
+
+    async def traced_invoke(query, *args, **kwargs):
+        with span(f"telegram.{type(query).__name__}"):
+            return await invoke(query, *args, **kwargs)
+
+    client.invoke = traced_invoke
+
+def _finish(trace: Trace):
+    """Hand a finished trace to the configured sinks."""
+    RECENT_TRACES.append(trace)
+
+    if TRACE_LOG_ENABLED:
+        trace_logger.info(json.dumps(trace.to_dict(), default=str))
+
+    if TRACE_OTLP_ENDPOINT:
+        try:
+            asyncio.get_running_loop().create_task(_export_otlp(trace))
+        except RuntimeError:
+            pass
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    result = []
+    for key, value in attributes.items():
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            result.append({"key": key, "value": {"boolValue": value}})
+        elif isinstance(value, int):
+            result.append({"key": key, "value": {"intValue": str(value)}})
+        elif isinstance(value, float):
+            result.append({"key": key, "value": {"doubleValue": value}})
+        else:
+            result.append({"key": key, "value": {"stringValue": str(value)}})
+    return result
+
+def _otlp_payload(trace: Trace) -> Dict[str, Any]:
+    """Build an OTLP/HTTP JSON export request for a trace."""
+    spans = []
+    for item in trace.spans:
+        otlp_span = {
+            "traceId": trace.trace_id,
+            "spanId": item.span_id,
+            "name": item.name,
+            "kind": 1,
+            "startTimeUnixNano": str(item.start_ns),
+            "endTimeUnixNano": str(item.end_ns or item.start_ns),
+            "attributes": _otlp_attributes({**item.attributes, "request_id": trace.request_id}),
+        }
+        if item.parent:
+            otlp_span["parentSpanId"] = item.parent.span_id
+        if item.error:
+            otlp_span["status"] = {"code": 2, "message": item.error}
+        spans.append(otlp_span)
+
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": _otlp_attributes({"service.name": "music-bot"})},
+            "scopeSpans": [{"scope": {"name": "music-bot"}, "spans": spans}],
+        }]
+    }
+
+def _post_json(url: str, payload: Dict[str, Any]):
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(payload).encode(),
+        headers={"Content-Type": "application/json"},
+        method="POST"
+    )
+    with urllib.request.urlopen(request, timeout=5) as response:
+        response.read()
+
+async def _export_otlp(trace: Trace):
+    try:
+        await asyncio.to_thread(_post_json, TRACE_OTLP_ENDPOINT, _otlp_payload(trace))
+    except Exception as e:
+        logger.debug(f"Error exporting trace {trace.request_id}: {e}")
+
+def slowest(limit: int = 5, name: Optional[str] = None) -> List[Trace]:
+    """Return the slowest recent traces, optionally filtered by name."""
+    traces = [trace for trace in RECENT_TRACES if name is None or trace.name == name]
+    return sorted(traces, key=lambda trace: trace.duration_ms, reverse=True)[:limit]
+
+def format_trace(trace: Trace) -> str:
+    """Format a trace as an indented per-stage breakdown."""
+    lines = [f"**{trace.name}** `{trace.request_id}` — {trace.duration_ms:.0f}ms"]
+    for item in trace.spans[1:]:
+        indent = "  " * (item.depth - 1)
+        error = " ⚠️" if item.error else ""
+        lines.append(f"{indent}• {item.name}: {item.duration_ms:.0f}ms{error}")
+    return "\n".join(lines)
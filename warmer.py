@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Optional, Set
+
+import sources
+from sources import registry
+from filecache import file_cache
+from history import play_history
+from config import WARM_INTERVAL, WARM_TOP_K
+from metrics import CACHE_WARMS
+
+logger = logging.getLogger("warmer")
+
+# Seconds between writes of new plays to the history log
+FLUSH_INTERVAL = 60
+
+class CacheWarmer:
+    """Background task that keeps the most played tracks ready to play.
+
+    Loads the play history on start, then every ``interval`` seconds resolves
+    popular links that aren't in the resolve cache and marks popular Telegram
+    uploads as recently used so the file cache doesn't evict them. The first
+    pass runs right away, so a restart doesn't begin with cold caches.
+    """
+
+    def __init__(self, interval: int = WARM_INTERVAL, top_k: int = WARM_TOP_K):
+        self.interval = interval
+        self.top_k = top_k
+        self.live: Set[str] = set()
+        self.last_report: Optional[Dict[str, int]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Start the warmer loop."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            if self.interval > 0:
+                logger.info(f"Cache warmer started (interval {self.interval}s, top {self.top_k}).")
+            else:
+                logger.info("Cache warming disabled, recording play history only.")
+
+    async def stop(self):
+        """Stop the warmer loop and write out the remaining play history."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.to_thread(play_history.flush)
+
+    async def _run(self):
+        try:
+            loaded = await asyncio.to_thread(play_history.load)
+            logger.info(f"Loaded {loaded} plays from the history log.")
+        except Exception as e:
+            logger.error(f"Error loading play history: {e}")
+
+        next_warm = 0.0
+        while True:
+            if self.interval > 0 and time.monotonic() >= next_warm:
+                next_warm = time.monotonic() + self.interval
+                try:
+                    await self.warm()
+                except Exception as e:
+                    logger.error(f"Error warming caches: {e}")
+
+            try:
+                await asyncio.to_thread(play_history.flush)
+            except Exception as e:
+                logger.error(f"Error flushing play history: {e}")
+            await asyncio.sleep(FLUSH_INTERVAL)
+
+    async def warm(self) -> Dict[str, int]:
+        """Run a single warming pass over the top tracks and return what it did."""
+        report = {"resolved": 0, "cached": 0, "kept": 0, "failed": 0}
+
+        for track, _ in play_history.top(self.top_k):
+            if track.startswith("telegram:"):
+                if file_cache.touch(track[len("telegram:"):]):
+                    report["kept"] += 1
+                continue
+
+            # Live streams are never cached, so resolving them ahead is wasted
+            if track in self.live or registry.for_url(track) is None:
+                continue
+            if registry.is_resolved(track):
+                report["cached"] += 1
+                continue
+
+            info, _ = await registry.resolve(track)
+            if info is None:
+                report["failed"] += 1
+            else:
+                report["resolved"] += 1
+                if sources.is_live(info):
+                    self.live.add(track)
+
+        for result, count in report.items():
+            CACHE_WARMS.inc(count, result=result)
+        self.last_report = report
+
+        if report["resolved"] or report["failed"]:
+            logger.info(
+                f"Cache warmer resolved {report['resolved']} tracks ({report['failed']} failed); "
+                f"{report['cached']} were already cached and {report['kept']} uploads kept on disk"
+            )
+        return report
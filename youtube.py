@@ -1,13 +1,36 @@
 
 import asyncio
 import logging
-from typing import Dict, Optional, List, Tuple
-import yt_dlp
+import random
+import threading
+import time
+from typing import Any, Dict, Optional, List, Tuple
 import re
 from urllib.parse import urlparse, parse_qs
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+from config import (
+    BLOCK_AGE_RESTRICTED,
+    EXTRACT_RATE_LIMIT,
+    EXTRACT_BURST,
+    BREAKER_THRESHOLD,
+    BACKOFF_BASE,
+    BACKOFF_MAX,
+    SOURCE_ADDRESSES,
+)
+from admission import TokenBucket
+from metrics import EXTRACTION_LATENCY, UPSTREAM_ERRORS, UPSTREAM_CIRCUIT_OPEN, UPSTREAM_RATE
+from tracing import span
+from sources import (
+    PRIVATE_LINK_ERROR,
+    Source,
+    UpstreamUnavailable,
+    registry,
+    check_entry,
+    is_live,
+    is_public_url,
+    rejection_message,
+)
+
 logger = logging.getLogger("youtube")
 
 # YT-DLP options
@@ -30,12 +53,324 @@ YTDL_OPTIONS = {
             "player_skip": ["js", "configs", "webpage"],
         },
     },
+    # Live videos have no formats without HLS; let match_filter hand them to the live client
+    "ignore_no_formats_error": True,
+}
+
+# Live streams are only served over HLS, so the live client keeps it and picks
+# the smallest variant that carries audio (the video track is dropped anyway)
+LIVE_YTDL_OPTIONS = {
+    **YTDL_OPTIONS,
+    "format": "bestaudio[protocol^=m3u8]/best[protocol^=m3u8][height<=?360]/bestaudio/best",
+    "extractor_args": {
+        "youtube": {
+            "player_skip": ["js", "configs", "webpage"],
+        },
+    },
+    "ignore_no_formats_error": False,
+}
+
+def _match_filter(info: Dict[str, Any], *, incomplete: bool = False) -> Optional[str]:
+    """yt-dlp ``match_filter`` so rejected videos skip format selection.
+    
+    Live videos are stopped here too; they are re-extracted by the live client.
+    """
+    reason = check_entry(info) or ("live" if is_live(info) else None)
+    if reason:
+        return f"{info.get('title') or info.get('id')}: {reason}"
+    return None
+
+def _live_match_filter(info: Dict[str, Any], *, incomplete: bool = False) -> Optional[str]:
+    reason = check_entry(info)
+    if reason:
+        return f"{info.get('title') or info.get('id')}: {reason}"
+    return None
+
+YTDL_OPTIONS["match_filter"] = _match_filter
+LIVE_YTDL_OPTIONS["match_filter"] = _live_match_filter
+if BLOCK_AGE_RESTRICTED:
+    YTDL_OPTIONS["age_limit"] = LIVE_YTDL_OPTIONS["age_limit"] = 17
+
+# Related tracks come from YouTube's auto-generated mix playlist, listed flat
+RELATED_YTDL_OPTIONS = {
+    **YTDL_OPTIONS,
+    "noplaylist": False,
+    "extract_flat": "in_playlist",
+    "playlistend": 25,
 }
 
-# Create YT-DLP client
-ytdl = yt_dlp.YoutubeDL(YTDL_OPTIONS)
+# Client variants, see ExtractorClient.get
+YTDL_MODES = {"vod": YTDL_OPTIONS, "live": LIVE_YTDL_OPTIONS, "related": RELATED_YTDL_OPTIONS}
+
+# Upstream errors, told apart by yt-dlp's error messages
+THROTTLED_ERRORS = ("http error 429", "too many requests", "sign in to confirm", "rate-limit", "rate limit")
+NOT_FOUND_ERRORS = (
+    "video unavailable", "private video", "has been removed", "http error 404", "http error 410",
+    "unsupported url", "incomplete youtube id", "does not exist", "not available",
+)
+TRANSIENT_ERRORS = (
+    "timed out", "timeout", "connection reset", "connection refused", "connection aborted",
+    "temporary failure", "remote end closed", "incompleteread", "http error 500", "http error 502",
+    "http error 503", "http error 504",
+)
+
+def classify_error(error: Exception) -> str:
+    """Sort an extraction error into ``throttled``, ``not_found``, ``transient`` or ``error``."""
+    message = str(error).lower()
+    if any(pattern in message for pattern in THROTTLED_ERRORS):
+        return "throttled"
+    if any(pattern in message for pattern in NOT_FOUND_ERRORS):
+        return "not_found"
+    if any(pattern in message for pattern in TRANSIENT_ERRORS) or isinstance(error, (TimeoutError, ConnectionError)):
+        return "transient"
+    return "error"
+
+class RateLimiter:
+    """Global token bucket for upstream requests that adapts to throttling.
+
+    The rate is halved whenever an upstream throttles us and creeps back up
+    with each success (AIMD), so we settle just below what upstream accepts.
+    """
+
+    def __init__(self, rate: float = EXTRACT_RATE_LIMIT, burst: int = EXTRACT_BURST):
+        # Rates are configured per minute
+        self.max_rate = rate / 60
+        self.bucket = TokenBucket(self.max_rate, burst) if rate > 0 else None
+        UPSTREAM_RATE.set(rate)
+
+    async def acquire(self):
+        """Wait for a request token."""
+        if self.bucket is None:
+            return
+        while not self.bucket.try_acquire():
+            await asyncio.sleep(self.bucket.retry_after())
+
+    def _set_rate(self, rate: float):
+        self.bucket.rate = rate
+        UPSTREAM_RATE.set(rate * 60)
+
+    def throttled(self):
+        if self.bucket is not None:
+            self._set_rate(max(self.max_rate / 8, self.bucket.rate / 2))
+
+    def succeeded(self):
+        if self.bucket is not None and self.bucket.rate < self.max_rate:
+            self._set_rate(min(self.max_rate, self.bucket.rate + self.max_rate / 20))
+
+class CircuitBreaker:
+    """Health of one upstream as seen from one local address.
+
+    Throttling opens the circuit at once, other transient errors after
+    ``threshold`` in a row. It stays open for a backoff that doubles on each
+    trip, then lets a single probe through and closes again if that works.
+    """
+
+    def __init__(
+        self,
+        upstream: str,
+        address: str,
+        threshold: int = BREAKER_THRESHOLD,
+        base: float = BACKOFF_BASE,
+        maximum: float = BACKOFF_MAX
+    ):
+        self.upstream = upstream
+        self.address = address
+        self.threshold = threshold
+        self.base = base
+        self.maximum = maximum
+        self.failures = 0
+        self.trips = 0
+        self.open_until = 0.0
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if not self.open_until:
+            return "closed"
+        return "open" if time.monotonic() < self.open_until else "half_open"
+
+    def retry_after(self) -> float:
+        return max(0.0, self.open_until - time.monotonic())
+
+    def allow(self) -> bool:
+        """Check if a request may go through, claiming the probe when half-open."""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def record_success(self):
+        if self.open_until:
+            logger.info(f"{self.upstream} via {self.address} recovered")
+            UPSTREAM_CIRCUIT_OPEN.set(0, upstream=self.upstream, address=self.address)
+        self.failures = 0
+        self.trips = 0
+        self.open_until = 0.0
+        self.probing = False
+
+    def record_failure(self, kind: str):
+        self.probing = False
+        self.failures += 1
+        # A failed probe reopens the circuit straight away
+        if kind != "throttled" and not self.open_until and self.failures < self.threshold:
+            return
+
+        backoff = min(self.maximum, self.base * 2 ** self.trips) * random.uniform(0.8, 1.2)
+        self.trips += 1
+        self.failures = 0
+        self.open_until = time.monotonic() + backoff
+        UPSTREAM_CIRCUIT_OPEN.set(1, upstream=self.upstream, address=self.address)
+        logger.warning(f"Pausing {self.upstream} via {self.address} for {backoff:.0f}s after {kind} errors")
+
+class ExtractorClient:
+    """YT-DLP clients bound to one local address, created on first use (see warm_up)."""
+
+    def __init__(self, address: str):
+        self.address = address
+        self.ytdl: Dict[str, Any] = {}
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, mode: str = "vod"):
+        """Return this address's YT-DLP client for a mode in ``YTDL_MODES``, importing yt-dlp on first use."""
+        ytdl = self.ytdl.get(mode)
+        if ytdl is None:
+            with self._lock:
+                ytdl = self.ytdl.get(mode)
+                if ytdl is None:
+                    import yt_dlp
+                    ytdl = self.ytdl[mode] = yt_dlp.YoutubeDL({**YTDL_MODES[mode], "source_address": self.address})
+        return ytdl
+
+    def breaker(self, upstream: str) -> CircuitBreaker:
+        breaker = self.breakers.get(upstream)
+        if breaker is None:
+            breaker = self.breakers[upstream] = CircuitBreaker(upstream, self.address)
+        return breaker
+
+    def extract(self, url: str, process: bool, mode: str) -> Optional[Dict[str, Any]]:
+        info = self.get(mode).extract_info(url, download=False, process=process)
+        if info and info.get("entries") is not None:
+            # Entries may be generated lazily; fetch them on the pool thread
+            info["entries"] = list(info["entries"])
+        return info
+
+class UpstreamController:
+    """Rate limits yt-dlp requests and spreads them over the local addresses.
+
+    Each upstream (YouTube, SoundCloud, a radio host...) gets a circuit breaker
+    per address; requests round-robin over the addresses whose circuit lets
+    them through, and a throttled or transient failure is retried once on the
+    next one (or raises :class:`UpstreamUnavailable` if none is left).
+    """
+
+    def __init__(self, addresses: List[str] = SOURCE_ADDRESSES):
+        self.clients = [ExtractorClient(address) for address in addresses]
+        self.limiter = RateLimiter()
+        self._next = 0
+
+    def _pick(self, upstream: str) -> ExtractorClient:
+        for offset in range(len(self.clients)):
+            client = self.clients[(self._next + offset) % len(self.clients)]
+            if client.breaker(upstream).allow():
+                self._next = (self._next + offset + 1) % len(self.clients)
+                return client
+        raise UpstreamUnavailable(
+            upstream, min(client.breaker(upstream).retry_after() for client in self.clients)
+        )
+
+    def _record(self, client: ExtractorClient, upstream: str, error: Optional[Exception]):
+        breaker = client.breaker(upstream)
+        kind = classify_error(error) if error else None
+        if kind is None or kind == "not_found":
+            # Upstream answered, even if the video is gone
+            breaker.record_success()
+            self.limiter.succeeded()
+            return kind
+
+        UPSTREAM_ERRORS.inc(upstream=upstream, kind=kind)
+        if kind == "throttled":
+            self.limiter.throttled()
+        if kind in ("throttled", "transient"):
+            breaker.record_failure(kind)
+        else:
+            breaker.probing = False
+        return kind
+
+    async def extract(self, upstream: str, url: str, process: bool, mode: str) -> Optional[Dict[str, Any]]:
+        for attempt in range(2):
+            await self.limiter.acquire()
+            client = self._pick(upstream)
+            breaker = client.breaker(upstream)
+            probe = breaker.probing
+            try:
+                info = await registry.run(client.extract, url, process, mode)
+            except asyncio.CancelledError:
+                # The caller gave up; hand the half-open probe to the next request
+                if probe:
+                    breaker.probing = False
+                raise
+            except Exception as e:
+                kind = self._record(client, upstream, e)
+                if kind not in ("throttled", "transient") or attempt:
+                    raise
+                logger.warning(f"Retrying {url} after {kind} error via {client.address}: {e}")
+                continue
+            self._record(client, upstream, None)
+            return info
+
+# Create global upstream controller instance
+upstream = UpstreamController()
+
+def get_ytdl(mode: str = "vod"):
+    """Return the YT-DLP client for the first local address."""
+    return upstream.clients[0].get(mode)
+
+async def warm_up():
+    """Import yt-dlp and build the clients in the background."""
+    for client in upstream.clients:
+        await registry.run(client.get)
+    logger.info("yt-dlp ready.")
+
+async def _extract_info(
+    url: str, process: bool = True, mode: str = "vod", source: str = "youtube"
+) -> Optional[Dict[str, Any]]:
+    """Run ``extract_info`` on the extractor pool, through the upstream controller.
+    
+    With ``process=False`` search results come back flat: only what the
+    results page lists (id, title, duration, live status), without fetching
+    every video. ``mode="live"`` uses the client that keeps HLS formats and
+    ``mode="related"`` the one that lists playlists flat.
+    Raises :class:`UpstreamUnavailable` while ``source`` is paused.
+    """
+    return await upstream.extract(source, url, process, mode)
+
+def _flat_entry(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """Normalize a flat search result to the fields a full extraction has."""
+    thumbnails = entry.get("thumbnails") or []
+    return {
+        **entry,
+        "webpage_url": entry.get("webpage_url") or entry.get("url", ""),
+        "thumbnail": entry.get("thumbnail") or (thumbnails[-1].get("url", "") if thumbnails else ""),
+    }
+
+async def _flat_search(search_query: str, source: str = "youtube") -> List[Dict[str, Any]]:
+    """Run a yt-dlp search such as ``ytsearch5:query`` without extracting each result."""
+    info = await _extract_info(search_query, process=False, source=source)
+    if info and 'entries' in info:
+        return [_flat_entry(entry) for entry in info['entries'] if entry]
+    return []
 
 # Functions
+
+def stream_expiry(url: str) -> Optional[int]:
+    """Return the Unix time a signed stream URL stops working, if it says."""
+    match = re.search(r'[/?&]expire[/=](\d+)', url)
+    return int(match.group(1)) if match else None
+
 def is_youtube_url(url: str) -> bool:
     """Check if the provided URL is a YouTube URL."""
     patterns = [
@@ -62,68 +397,136 @@ def extract_video_id(url: str) -> Optional[str]:
     
     return None
 
-async def search_youtube(query: str, limit: int = 5) -> List[Dict]:
-    """Search for videos on YouTube without using cookies."""
-    try:
-        # If query is a valid YouTube URL, extract info directly
-        if is_youtube_url(query):
-            info = await asyncio.to_thread(
-                ytdl.extract_info, query, download=False
-            )
-            if info:
-                return [info]
-        
-        # Otherwise, search for videos using the query
-        else:
-            search_query = f"ytsearch{limit}:{query}"
-            info = await asyncio.to_thread(
-                ytdl.extract_info, search_query, download=False
-            )
-            if info and 'entries' in info:
-                return info['entries']
-        
-        return []
+def _pick_audio_url(info: Dict[str, Any]) -> Optional[str]:
+    # Live formats are muxed HLS variants; use the one yt-dlp selected
+    if is_live(info) and info.get('url'):
+        return info['url']
     
-    except Exception as e:
-        logger.error(f"Error searching YouTube: {e}")
-        return []
+    # Find the best audio format
+    for format_id in info.get('formats') or []:
+        if format_id.get('acodec') != 'none' and format_id.get('vcodec') == 'none':
+            return format_id['url']
+    
+    # If no audio-only format was found, use the best format available
+    return info.get('url')
 
-async def get_audio_url(video_url: str) -> Tuple[Optional[Dict], Optional[str]]:
-    """Get audio URL and metadata for a YouTube video without using cookies."""
+async def get_audio_url(
+    video_url: str, live: bool = False, source: str = "youtube"
+) -> Tuple[Optional[Dict], Optional[str]]:
+    """Get audio URL and metadata for a YouTube video without using cookies.
+    
+    Pass ``live=True`` when the video is already known to be live to skip
+    straight to the live client. ``source`` names the upstream for health
+    tracking; :class:`UpstreamUnavailable` is raised while it is paused.
+    """
     try:
         # Extract info without downloading
-        info = await asyncio.to_thread(
-            ytdl.extract_info, video_url, download=False
-        )
+        if not live:
+            with span("youtube.get_audio_url", url=video_url), EXTRACTION_LATENCY.time(kind="resolve"):
+                info = await _extract_info(video_url, source=source)
+            
+            if not info:
+                return None, "Failed to extract video information"
+            
+            # yt-dlp's match_filter stops before format selection but still returns the info
+            reason = check_entry(info)
+            if reason:
+                return None, rejection_message(reason, info)
+            live = is_live(info)
         
-        if not info:
-            return None, "Failed to extract video information"
+        if live:
+            with span("youtube.get_live_url", url=video_url), EXTRACTION_LATENCY.time(kind="live"):
+                info = await _extract_info(video_url, mode="live", source=source)
+            
+            if not info:
+                return None, "Failed to extract live stream information"
+            
+            reason = check_entry(info)
+            if reason:
+                return None, rejection_message(reason, info)
         
-        # Find the best audio format
-        for format_id in info.get('formats', []):
-            if format_id.get('acodec') != 'none' and format_id.get('vcodec') == 'none':
-                audio_url = format_id['url']
-                return info, audio_url
-        
-        # If no audio-only format was found, use the best format available
-        if info.get('url'):
-            return info, info['url']
+        audio_url = _pick_audio_url(info)
+        if audio_url:
+            return info, audio_url
         
         return None, "No suitable audio format found"
     
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         logger.error(f"Error getting audio URL: {e}")
         return None, f"Error: {str(e)}"
 
-def format_duration(duration: Optional[int]) -> str:
-    """Format duration in seconds to MM:SS format."""
-    if duration is None:
-        return "Unknown"
+class YtDlpSource(Source):
+    """Base for sources extracted by yt-dlp; they share its clients and the extractor pool."""
+    search_prefix = ""
+    
+    def upstream(self, url: str) -> str:
+        """Name the upstream whose health a link's extraction counts towards."""
+        return self.name
+    
+    def expires_at(self, stream_url: str) -> Optional[float]:
+        return stream_expiry(stream_url)
+    
+    async def search(self, query: str, limit: int) -> List[Dict[str, Any]]:
+        with span(f"{self.name}.search", query=query, limit=limit), EXTRACTION_LATENCY.time(kind="search"):
+            return await _flat_search(f"{self.search_prefix}{limit}:{query}", self.name)
+    
+    async def resolve(self, url: str, live: bool = False) -> Tuple[Optional[Dict], Optional[str]]:
+        return await get_audio_url(url, live, self.upstream(url))
+
+class YouTubeSource(YtDlpSource):
+    name = "youtube"
+    label = "🎵 YouTube"
+    searchable = True
+    search_prefix = "ytsearch"
+    
+    def matches(self, query: str) -> bool:
+        return is_youtube_url(query)
+    
+    def cache_key(self, url: str) -> str:
+        return extract_video_id(url) or url
+    
+    def url_for_id(self, item_id: str) -> str:
+        return f"https://www.youtube.com/watch?v={item_id}"
+    
+    async def related(self, url: str, limit: int) -> List[Dict[str, Any]]:
+        video_id = extract_video_id(url)
+        if not video_id:
+            return []
+        
+        with span("youtube.related", url=url), EXTRACTION_LATENCY.time(kind="related"):
+            info = await _extract_info(
+                f"https://www.youtube.com/watch?v={video_id}&list=RD{video_id}", mode="related", source=self.name
+            )
+        
+        entries = [_flat_entry(entry) for entry in (info or {}).get("entries") or [] if entry]
+        return [entry for entry in entries if entry.get("id") != video_id][:limit]
+
+class SoundCloudSource(YtDlpSource):
+    name = "soundcloud"
+    label = "☁️ SoundCloud"
+    searchable = True
+    search_prefix = "scsearch"
+    
+    def matches(self, query: str) -> bool:
+        return bool(re.match(r'^(https?://)?((www|m|api)\.)?soundcloud\.com/.+$', query))
+    
+    def url_for_id(self, item_id: str) -> str:
+        return f"https://api.soundcloud.com/tracks/{item_id}"
+
+class GenericSource(YtDlpSource):
+    """Any other link, e.g. radio streams and HLS playlists, via yt-dlp's generic extractor."""
+    name = "link"
+    
+    def matches(self, query: str) -> bool:
+        return bool(re.match(r'^https?://\S+$', query))
     
-    minutes, seconds = divmod(int(duration), 60)
-    hours, minutes = divmod(minutes, 60)
+    def upstream(self, url: str) -> str:
+        # One unreachable radio host shouldn't pause every other link
+        return urlparse(url).netloc or self.name
     
-    if hours > 0:
-        return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
-    else:
-        return f"{minutes:02d}:{seconds:02d}"
+    async def resolve(self, url: str, live: bool = False) -> Tuple[Optional[Dict], Optional[str]]:
+        if not await is_public_url(url):
+            return None, PRIVATE_LINK_ERROR
+        return await super().resolve(url, live)